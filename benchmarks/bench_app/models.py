@@ -0,0 +1,14 @@
+from django.db import models
+
+from model_ninja.db.models import AbstractHideableModel
+
+
+class BenchModel(AbstractHideableModel):
+    name = models.CharField(max_length=32, unique=True)
+    group = models.IntegerField()
+    
+    visible_indexes = ('group',)
+    maintain_counts = True
+    
+    class Meta:
+        app_label = 'bench_app'
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Benchmarks for HideableModelManager.
+
+Seeds a hideable table with each of the requested row counts and hidden
+ratio, then times the common manager operations and counts their queries:
+
+    python benchmarks/run.py --rows 10000 100000 --output results.json
+    python benchmarks/run.py --rows 10000 --compare results.json
+
+Use --engine postgresql (with --name, --host, --port, --user and --password)
+to run against a local PostgreSQL server instead of SQLite. With --compare,
+the results are checked against an earlier --output file and the exit status
+is 1 if any benchmark got slower by more than --threshold or ran more
+queries. Timings are compared by their minimum over --repeat calls, which
+is the least affected by other load on the machine, and differences below
+--min-delta milliseconds are ignored.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.dirname(os.path.abspath(__file__))]
+
+
+def configure(args):
+    import django
+    from django.conf import settings
+
+    if args.engine == 'sqlite':
+        database = {'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': args.name or os.path.join(tempfile.gettempdir(),
+                                                      'model_ninja_bench.sqlite3')}
+    else:
+        database = {'ENGINE': 'django.db.backends.postgresql',
+                    'NAME': args.name or 'model_ninja_bench', 'HOST': args.host,
+                    'PORT': args.port, 'USER': args.user, 'PASSWORD': args.password}
+    settings.configure(
+        DATABASES={'default': database},
+        INSTALLED_APPS=['model_ninja', 'bench_app'],
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        DEFAULT_AUTO_FIELD='django.db.models.AutoField',
+        USE_TZ=True)
+    django.setup()
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, repeat):
+    # Returns the timings of 'repeat' calls of 'func' and the queries per call
+    from django.db import connection
+
+    counter = QueryCounter()
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            func(i)
+        timings.append(time.perf_counter() - start)
+    return {'median_ms': statistics.median(timings) * 1000,
+            'min_ms': min(timings) * 1000,
+            'mean_ms': statistics.mean(timings) * 1000,
+            'queries': counter.count / float(repeat)}
+
+
+def seed(rows, hidden_ratio, batch_size=10000):
+    # Recreates the table with 'rows' rows, a random 'hidden_ratio' of them
+    # hidden; inserted through the base manager so no counters are touched
+    from django.core.cache import cache
+    from django.db import connection
+    from bench_app.models import BenchModel
+
+    with connection.schema_editor() as editor:
+        if BenchModel._meta.db_table in connection.introspection.table_names():
+            editor.delete_model(BenchModel)
+        editor.create_model(BenchModel)
+    rng = random.Random(rows)
+    for start in range(0, rows, batch_size):
+        BenchModel._base_manager.bulk_create([
+            BenchModel(name='obj-%d' % i, group=i % 100,
+                       deleted=rng.random() < hidden_ratio)
+            for i in range(start, min(start + batch_size, rows))])
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE %s' % connection.ops.quote_name(BenchModel._meta.db_table))
+    cache.clear()
+
+
+def benchmarks(rows, batch):
+    from bench_app.models import BenchModel
+
+    objects = BenchModel.objects
+    rng = random.Random(0)
+    sample = [rng.randrange(1, rows + 1) for i in range(2000)]
+    names = list(objects.filter(pk__in=sample).values_list('name', flat=True)[:1000])
+
+    def hide_unhide(i):
+        pks = list(objects.filter(group=i % 100).values_list('pk', flat=True)[:batch])
+        objects.filter(pk__in=pks).hide(chunk_size=1000)
+        objects.filter(include_hidden=True, pk__in=pks).unhide(chunk_size=1000)
+
+    return [
+        ('filter', lambda i: list(objects.filter(group=i % 100)[:100])),
+        ('get', lambda i: objects.get(name=names[i % len(names)])),
+        ('all', lambda i: list(objects.all()[:1000])),
+        ('count', lambda i: objects.count()),
+        ('count_maintained', lambda i: objects.counts()),
+        ('get_or_create_existing', lambda i: objects.get_or_create(name=names[i % len(names)])),
+        ('get_or_create_new', lambda i: objects.get_or_create(name='new-%d-%d' % (rows, i),
+                                                              defaults={'group': 0})),
+        ('hide_unhide_%d' % batch, hide_unhide),
+    ]
+
+
+def run(args):
+    import django
+    from django.db import connection
+
+    results = {'meta': {'engine': connection.vendor, 'django': django.get_version(),
+                        'python': platform.python_version(), 'hidden_ratio': args.hidden_ratio,
+                        'repeat': args.repeat, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'results': {}}
+    for rows in args.rows:
+        sys.stderr.write('Seeding %d rows...\n' % rows)
+        seed(rows, args.hidden_ratio)
+        results['results'][str(rows)] = row_results = {}
+        for name, func in benchmarks(rows, args.batch):
+            if args.only and name not in args.only:
+                continue
+            row_results[name] = measure(func, args.repeat)
+            sys.stderr.write('%10d rows  %-20s %10.3f ms  %5.1f queries\n'
+                             % (rows, name, row_results[name]['median_ms'],
+                                row_results[name]['queries']))
+    return results
+
+
+def compare(baseline, results, threshold, min_delta):
+    # Returns a list of regressions of 'results' against 'baseline'
+    regressions = []
+    for rows, benches in results['results'].items():
+        for name, result in benches.items():
+            old = baseline['results'].get(rows, {}).get(name)
+            if old is None:
+                continue
+            if (result['min_ms'] > old['min_ms'] * (1 + threshold) and
+                    result['min_ms'] - old['min_ms'] > min_delta):
+                regressions.append('%s rows %s: %.3f ms -> %.3f ms'
+                                   % (rows, name, old['min_ms'], result['min_ms']))
+            if result['queries'] > old['queries']:
+                regressions.append('%s rows %s: %.1f -> %.1f queries'
+                                   % (rows, name, old['queries'], result['queries']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks for HideableModelManager.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help='Table sizes to benchmark, e.g. 10000 1000000 10000000.')
+    parser.add_argument('--hidden-ratio', type=float, default=0.1,
+                        help='Fraction of rows that are hidden (default: 0.1).')
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Calls per benchmark (default: 50).')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='Rows per bulk hide/unhide (default: 1000).')
+    parser.add_argument('--only', nargs='+', help='Only run these benchmarks.')
+    parser.add_argument('--output', help='Write the results to this JSON file.')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='Compare the results against an earlier JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Slowdown counted as a regression (default: 0.25).')
+    parser.add_argument('--min-delta', type=float, default=0.05,
+                        help='Smallest slowdown in ms counted as a regression '
+                             '(default: 0.05).')
+    parser.add_argument('--engine', choices=['sqlite', 'postgresql'], default='sqlite')
+    parser.add_argument('--name', help='Database name (or SQLite file).')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', default='')
+    parser.add_argument('--user', default='')
+    parser.add_argument('--password', default='')
+    args = parser.parse_args(argv)
+
+    configure(args)
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.threshold, args.min_delta)
+        for regression in regressions:
+            sys.stdout.write('REGRESSION %s\n' % regression)
+        if regressions:
+            return 1
+        sys.stdout.write('No regressions against %s\n' % args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
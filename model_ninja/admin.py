@@ -0,0 +1,142 @@
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import QuerySet
+
+from model_ninja.db.counts import estimated_count, CountedPaginator
+from model_ninja.db.utils import hidden_field_name
+
+
+class HiddenListFilter(admin.SimpleListFilter):
+    """
+    List filter for visible or hidden objects, filtering on the hidden field
+    itself so the database can use the visible-only (or hidden timestamp)
+    partial indexes.
+    """
+    title = 'visibility'
+    parameter_name = 'hidden'
+
+    def lookups(self, request, model_admin):
+        return (('0', 'Visible'), ('1', 'Hidden'))
+
+    def queryset(self, request, queryset):
+        if self.value() in ('0', '1'):
+            return queryset.filter(**{hidden_field_name(queryset.model): self.value() == '1'})
+        return queryset
+
+
+class EstimatedCountPaginator(CountedPaginator):
+    """
+    CountedPaginator that, for querysets the maintained counters can't
+    answer, takes the query planner's estimate (on PostgreSQL) instead of
+    running COUNT(*) once the estimate reaches 'estimate_threshold'.
+    """
+    estimate_threshold = 100000
+
+    def _count_query(self):
+        if isinstance(self.object_list, QuerySet):
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super(EstimatedCountPaginator, self)._count_query()
+
+
+class HideableChangeList(ChangeList):
+    def get_queryset(self, request, exclude_parameters=None):
+        queryset = super(HideableChangeList, self).get_queryset(request, exclude_parameters)
+        # related managers of hideable models leave out hidden objects, so
+        # prefetching through them doesn't load hidden children
+        prefetch = self.model_admin.get_list_prefetch_related(request)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+class HideableModelAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin for models with a HideableModelManager. Hidden objects are
+    only listed for superusers, and deleting objects as a staff user hides
+    them instead, so a superuser can restore them.
+
+    The 'hide_selected' and 'restore_selected' actions hide or restore the
+    selected objects with a single UPDATE (cascading along 'hide_relations'
+    where the model declares any), and users who see hidden objects get a
+    visible/hidden list filter. The changelist counts objects with
+    EstimatedCountPaginator and skips the count of all objects, and
+    prefetches the relations named in 'list_prefetch_related' without their
+    hidden objects.
+    """
+    actions = ['hide_selected', 'restore_selected']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_prefetch_related = ()
+
+    def can_see_hidden(self, request):
+        return request.user.is_superuser
+
+    def hides_on_delete(self, request):
+        return not request.user.is_superuser
+
+    def get_queryset(self, request):
+        queryset = super(HideableModelAdmin, self).get_queryset(request)
+        if self.can_see_hidden(request):
+            queryset = queryset.include_hidden()
+        return queryset
+
+    def get_changelist(self, request, **kwargs):
+        return HideableChangeList
+
+    def get_list_prefetch_related(self, request):
+        return self.list_prefetch_related
+
+    def get_list_filter(self, request):
+        list_filter = super(HideableModelAdmin, self).get_list_filter(request)
+        if self.can_see_hidden(request):
+            list_filter = (HiddenListFilter,) + tuple(list_filter)
+        return list_filter
+
+    def get_actions(self, request):
+        actions = super(HideableModelAdmin, self).get_actions(request)
+        if not self.can_see_hidden(request):
+            actions.pop('restore_selected', None)
+        return actions
+
+    def delete_model(self, request, obj):
+        if self.hides_on_delete(request):
+            self._hide(self.get_queryset(request).filter(pk=obj.pk))
+        else:
+            super(HideableModelAdmin, self).delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        if self.hides_on_delete(request):
+            self._hide(queryset)
+        else:
+            super(HideableModelAdmin, self).delete_queryset(request, queryset)
+
+    def _hide(self, queryset):
+        return queryset.hide(cascade=bool(getattr(self.model, 'hide_relations', None)))
+
+    @admin.action(description='Hide selected %(verbose_name_plural)s',
+                  permissions=['change'])
+    def hide_selected(self, request, queryset):
+        count = self._hide(queryset)
+        self.message_user(request, 'Hid %d %s.' % (count, self.opts.verbose_name_plural),
+                          messages.SUCCESS)
+
+    @admin.action(description='Restore selected %(verbose_name_plural)s',
+                  permissions=['change'])
+    def restore_selected(self, request, queryset):
+        count = queryset.unhide(cascade=bool(getattr(self.model, 'hide_relations', None)))
+        self.message_user(request, 'Restored %d %s.' % (count, self.opts.verbose_name_plural),
+                          messages.SUCCESS)
+
+
+class StaffHideableModelAdmin(HideableModelAdmin):
+    """
+    HideableModelAdmin that lists hidden objects for every staff user, and
+    deletes objects normally for all of them.
+    """
+    def can_see_hidden(self, request):
+        return request.user.is_staff
+
+    def hides_on_delete(self, request):
+        return False
@@ -0,0 +1,173 @@
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, transaction
+from django.db.models.sql.datastructures import BaseTable
+
+from model_ninja.db.signals import post_hide
+from model_ninja.db.utils import hidden_field_name, hidden_values, pk_batches
+
+
+ARCHIVE_ON_HIDE = 'on_hide'
+ARCHIVE_ON_SWEEP = 'sweep'
+
+
+def make_archive_model(model):
+    """
+    Creates the archive model for a hideable model with an 'archive_mode': a
+    model in the same app with the same columns, stored in '<table>_hidden'.
+    Relations from the archive model don't have reverse accessors, and unique
+    constraints are left out, since archived rows may share values with each
+    other or with rows in the main table.
+    """
+    opts = model._meta
+    if opts.parents:
+        raise ImproperlyConfigured("%s can't use an archive table, since it inherits "
+                                   "from a concrete model" % opts.object_name)
+
+    attrs = {'__module__': model.__module__,
+             '__doc__': 'Archived hidden objects of %s.' % opts.object_name}
+    for field in opts.local_concrete_fields:
+        name, path, args, kwargs = field.deconstruct()
+        if field.is_relation:
+            kwargs['related_name'] = '+'
+        if not field.primary_key:
+            kwargs.pop('unique', None)
+        attrs[name] = field.__class__(*args, **kwargs)
+
+    class Meta:
+        app_label = opts.app_label
+        apps = opts.apps
+        db_table = '%s_hidden' % opts.db_table
+        managed = opts.managed
+    attrs['Meta'] = Meta
+
+    return type('%sHidden' % opts.object_name, (models.Model,), attrs)
+
+
+def check_references(model):
+    """
+    Returns the system check errors of a model with an archive table: other
+    rows can't refer to its rows, since archiving deletes them from the main
+    table. Relations to the model are only all known once the app registry
+    is ready, so this isn't checked when the archive model is generated.
+    """
+    opts = model._meta
+    relations = ['%s.%s' % (rel.related_model._meta.label, rel.field.name)
+                 for rel in opts.related_objects]
+    relations.extend('%s.%s' % (opts.label, field.name) for field in opts.local_many_to_many)
+    if not relations:
+        return []
+    return [checks.Error(
+        "%s can't use archive_mode, since archiving deletes rows that other rows "
+        "refer to through %s." % (opts.label, ', '.join(sorted(relations))),
+        hint="Remove 'archive_mode', or the relations to the model.",
+        obj=model, id='model_ninja.E001')]
+
+
+class ArchiveUnionTable(BaseTable):
+    """
+    Base table of a query that includes archived objects: the main table and
+    the archive table combined with UNION ALL, under the main table's alias so
+    the rest of the query is unchanged.
+    """
+    def __init__(self, table_name, alias, archive_table, columns):
+        super(ArchiveUnionTable, self).__init__(table_name, alias)
+        self.archive_table = archive_table
+        self.columns = columns
+
+    def as_sql(self, compiler, connection):
+        qn = connection.ops.quote_name
+        columns = ', '.join(qn(column) for column in self.columns)
+        return ('(SELECT %s FROM %s UNION ALL SELECT %s FROM %s) %s'
+                % (columns, qn(self.table_name), columns, qn(self.archive_table),
+                   compiler.quote_name_unless_alias(self.table_alias))), []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(self.table_name,
+                              change_map.get(self.table_alias, self.table_alias),
+                              self.archive_table, self.columns)
+
+    @property
+    def identity(self):
+        return self.__class__, self.table_name, self.table_alias, self.archive_table
+
+
+def include_archive(query):
+    """
+    Makes 'query' read from both the main and the archive table of its model.
+    """
+    opts = query.get_meta()
+    alias = query.base_table if query.alias_map else query.get_initial_alias()
+    query.alias_map[alias] = ArchiveUnionTable(
+        opts.db_table, alias, opts.model.archive_model._meta.db_table,
+        [field.column for field in opts.concrete_fields])
+
+
+def move_rows(source, target, pks, using):
+    """
+    Moves the rows with the given primary keys from the table of 'source' to
+    the table of 'target' with INSERT ... SELECT and DELETE, so the rows never
+    pass through Python. Returns the number of rows moved.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    fields = source._meta.concrete_fields
+    rows = source._base_manager.using(using).filter(pk__in=pks)
+    select = rows.order_by().values_list(*[field.attname for field in fields])
+    select_sql, params = select.query.get_compiler(using).as_sql()
+
+    with transaction.atomic(using=using, savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO %s (%s) %s'
+                           % (qn(target._meta.db_table),
+                              ', '.join(qn(field.column) for field in fields),
+                              select_sql), params)
+            moved = cursor.rowcount
+        rows._raw_delete(using)
+    return moved
+
+
+def update_archived(model, pk, values, using, hidden=True):
+    """
+    Runs the UPDATE of Model.save() ('values' as passed to Model._do_update)
+    against the archive table, for objects of 'model' whose row was archived.
+    Returns False if the archive has no row with that primary key either.
+    Objects that are no longer hidden are moved back to the main table.
+    """
+    rows = model.archive_model._base_manager.using(using).filter(pk=pk)
+    if not values:
+        return rows.exists()
+    with transaction.atomic(using=using, savepoint=False):
+        if not rows.update(**dict((field.attname, value) for field, _, value in values)):
+            return False
+        if not hidden:
+            move_rows(model.archive_model, model, [pk], using)
+    return True
+
+
+def set_hidden(model, pks, hidden, using, timestamp=None):
+    """
+    Hides or unhides the objects of 'model' with the given primary keys and
+    returns the number of objects changed. 'timestamp' is stored as the
+    hidden time for models that record one (defaults to now). For models with
+    an archive table, unhidden objects are moved back from the archive, and
+    hidden objects are moved to it when the model's 'archive_mode' is
+    ARCHIVE_ON_HIDE.
+    """
+    name = hidden_field_name(model)
+    values = hidden_values(model, hidden, timestamp)
+    archive = getattr(model, 'archive_model', None)
+    queryset = model._base_manager.using(using).filter(**{name: not hidden})
+    count = 0
+    with transaction.atomic(using=using, savepoint=False):
+        for batch in pk_batches(pks, using):
+            if archive is not None and not hidden:
+                # restored rows are still hidden, so the UPDATE counts them
+                move_rows(archive, model, batch, using)
+            changed = queryset.filter(pk__in=batch).update(**values)
+            if archive is not None and hidden and model.archive_mode == ARCHIVE_ON_HIDE:
+                move_rows(model, archive, batch, using)
+            post_hide.send(sender=model, pks=batch, hidden=hidden, count=changed, 
+                           using=using)
+            count += changed
+    return count
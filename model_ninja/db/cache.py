@@ -0,0 +1,258 @@
+import contextlib
+import contextvars
+import copy
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import signals
+
+from model_ninja.db.signals import post_bulk_write, post_hide, post_purge
+
+
+_memo = contextvars.ContextVar('model_ninja_cache_memo', default=None)
+_caches = weakref.WeakSet()
+_connected = set()
+
+
+class LocalCache(object):
+    """
+    In-process cache tier: a dict of at most 'max_size' entries that evicts the
+    least recently used entry first and expires entries after 'timeout'
+    seconds.
+    """
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.timeout, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.data if key.startswith(prefix)]:
+                del self.data[key]
+
+
+class ObjectCache(object):
+    """
+    Cache of hideable model instances by primary key, used by
+    HideableModelManager.get_cached and in_bulk_cached. Lookups go through:
+
+    1) the per-request memo, while inside 'memoize()' or ObjectCacheMiddleware
+    2) an in-process LRU cache of 'local_size' entries ('local_timeout'
+       seconds; 0 turns it off)
+    3) the Django cache 'cache_alias' ('timeout' seconds; None turns it off)
+    4) the database
+
+    Objects are cached with their hidden state whether or not they are
+    hidden, and the hidden check is done on every lookup, so hidden objects
+    are never returned unless asked for.
+
+    Entries are invalidated when objects are saved, deleted, hidden,
+    unhidden or purged (post_save, post_delete, post_hide and post_purge),
+    and by bulk writes (post_bulk_write). Writes that don't report their primary keys
+    invalidate the whole model by bumping a version number kept in the
+    Django cache. Invalidation also runs again when the transaction commits.
+    The in-process tier of other processes only sees invalidations once its
+    entries expire, so keep 'local_timeout' short.
+
+    Only models that set 'cache_objects' can be cached. Their receivers are
+    connected when the model class is prepared, so processes that only write
+    invalidate the shared tier too. The post_delete receiver makes Django
+    load the objects removed by QuerySet.delete() to send post_delete.
+    """
+    def __init__(self, cache_alias=DEFAULT_CACHE_ALIAS, timeout=300, local_size=1000,
+                 local_timeout=5, prefix='model_ninja'):
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+        self.local = LocalCache(local_size, local_timeout) if local_timeout else None
+        self.prefix = prefix
+        _caches.add(self)
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.timeout is not None else None
+
+    def _model_prefix(self, model, using):
+        return '%s:%s:%s:' % (self.prefix, using, model._meta.label_lower)
+
+    def _version(self, model, using):
+        if self.shared is None:
+            return 0
+        return self.shared.get(self._model_prefix(model, using) + 'version', 0)
+
+    def get_many(self, manager, pks, include_hidden=False):
+        """
+        Returns a dict of the objects of 'manager' with the given primary keys,
+        leaving out hidden objects unless 'include_hidden' is True.
+        """
+        model, using = manager.model, manager.db
+        if model not in _connected:
+            raise ImproperlyConfigured("%s can't be cached without 'cache_objects'"
+                                       % model._meta.object_name)
+        prefix = self._model_prefix(model, using)
+        pks = [model._meta.pk.to_python(pk) for pk in pks]
+        keys = dict((prefix + str(pk), pk) for pk in pks)
+        memo = _memo.get()
+        found = {}
+
+        missing = []
+        for key in keys:
+            value = memo.get(key) if memo is not None else None
+            if value is None and self.local is not None:
+                value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+
+        if missing and self.shared is not None:
+            version_key = prefix + 'version'
+            values = self.shared.get_many(missing + [version_key])
+            version = values.pop(version_key, 0)
+            for key, value in values.items():
+                if value[0] == version:
+                    found[key] = value[1:]
+                    if self.local is not None:
+                        self.local.set(key, value[1:])
+            missing = [key for key in missing if key not in found]
+
+        if missing:
+            version = self._version(model, using)
+            objs = manager.db_manager(using).filter(
+                include_hidden=True, pk__in=[keys[key] for key in missing])
+            to_store = {}
+            for obj in objs:
+                key = prefix + str(obj.pk)
+                value = (bool(getattr(obj, manager.hidden_field_name)), obj)
+                found[key] = to_store[key] = value
+                if self.local is not None:
+                    self.local.set(key, value)
+            if to_store and self.shared is not None:
+                self.shared.set_many(dict((key, (version,) + value)
+                                          for key, value in to_store.items()),
+                                     self.timeout)
+
+        if memo is not None:
+            memo.update(found)
+        return dict((keys[key], copy.copy(obj)) for key, (hidden, obj) in found.items()
+                    if include_hidden or not hidden)
+
+    def invalidate(self, model, pks, using):
+        """
+        Drops the cached objects of 'model' with the given primary keys, or all
+        of the model's cached objects if 'pks' is None.
+        """
+        prefix = self._model_prefix(model, using)
+        memo = _memo.get()
+        if pks is None:
+            if self.shared is not None:
+                try:
+                    self.shared.incr(prefix + 'version')
+                except ValueError:
+                    self.shared.add(prefix + 'version', 1, None)
+            if self.local is not None:
+                self.local.delete_prefix(prefix)
+            if memo is not None:
+                for key in [key for key in memo if key.startswith(prefix)]:
+                    del memo[key]
+            return
+
+        keys = [prefix + str(pk) for pk in pks]
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+        for key in keys:
+            if self.local is not None:
+                self.local.delete(key)
+            if memo is not None:
+                memo.pop(key, None)
+
+
+default_cache = ObjectCache()
+
+
+@contextlib.contextmanager
+def memoize():
+    """
+    Context manager that memoizes cached lookups until it exits, so repeated
+    lookups of an object only hit the other cache tiers once.
+    """
+    token = _memo.set({})
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+class ObjectCacheMiddleware(object):
+    """
+    Middleware that memoizes cached lookups for the duration of each request.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with memoize():
+            return self.get_response(request)
+
+
+def _invalidate(sender, pks, using):
+    def invalidate():
+        for cache in list(_caches):
+            cache.invalidate(sender, pks, using)
+    invalidate()
+    # readers may have cached the old state again before the commit
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(invalidate, using=using)
+
+
+def _on_save_or_delete(sender, instance, using, **kwargs):
+    _invalidate(sender, [instance.pk], using)
+
+
+def _on_bulk(sender, pks, using, **kwargs):
+    _invalidate(sender, None if pks is None else list(pks), using)
+
+
+def connect(model):
+    """
+    Connects the receivers that invalidate the cached objects of 'model'.
+    Done for every model with 'cache_objects' set when the model class is
+    prepared; other models get none, since any post_delete receiver turns
+    off fast deletes for its sender.
+    """
+    if model in _connected:
+        return
+    signals.post_save.connect(_on_save_or_delete, sender=model, weak=False,
+                              dispatch_uid='model_ninja_cache')
+    signals.post_delete.connect(_on_save_or_delete, sender=model, weak=False,
+                                dispatch_uid='model_ninja_cache')
+    for signal in (post_hide, post_purge, post_bulk_write):
+        signal.connect(_on_bulk, sender=model, weak=False, dispatch_uid='model_ninja_cache')
+    _connected.add(model)
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from model_ninja.db.archive import set_hidden
+from model_ninja.db.utils import hidden_field_name, pk_batches
+
+
+HIDE_CASCADE = 'cascade'
+HIDE_PROTECT = 'protect'
+HIDE_IGNORE = 'ignore'
+
+
+class HideProtectedError(IntegrityError):
+    """
+    Raised when hiding an object would leave visible objects behind on a
+    relation declared with HIDE_PROTECT.
+    """
+    def __init__(self, msg, protected_objects):
+        self.protected_objects = protected_objects
+        super(HideProtectedError, self).__init__(msg, protected_objects)
+
+
+def _related_lookup(model, name):
+    # Returns (related model, lookup from the related model back to 'model')
+    # for a reverse relation or many-to-many field named in 'hide_relations'.
+    # Reverse relations can be named by accessor (e.g. 'book_set') as well.
+    opts = model._meta
+    try:
+        field = opts.get_field(name)
+    except FieldDoesNotExist:
+        field = None
+        for rel in opts.related_objects:
+            if rel.get_accessor_name() == name:
+                field = rel
+                break
+    if field is not None and field.is_relation:
+        if field.auto_created and not field.concrete:
+            return field.related_model, field.field.name
+        if field.many_to_many:
+            return field.related_model, field.related_query_name()
+    raise ImproperlyConfigured("'%s' in %s.hide_relations is not a reverse relation "
+                               "or many-to-many field" % (name, opts.object_name))
+
+
+class HideCollector(object):
+    """
+    Collects the objects affected by hiding (or unhiding) a set of objects,
+    following the 'hide_relations' declared on each model, e.g.:
+
+        hide_relations = {'books': HIDE_CASCADE, 'orders': HIDE_PROTECT}
+
+    Relations that aren't declared are ignored. The relation graph is walked
+    breadth first with one query per model and relation, and 'execute' then
+    issues one UPDATE per model (split into batches only where the database
+    limits query parameters) in a single transaction.
+
+    Unhiding follows the same HIDE_CASCADE relations and restores every hidden
+    dependent, whether it was hidden by the cascade or on its own.
+    HIDE_PROTECT only applies when hiding.
+    """
+    def __init__(self, using, hidden=True, timestamp=None):
+        self.using = using
+        self.hidden = hidden
+        self.timestamp = timestamp or timezone.now()
+        self.data = OrderedDict()
+
+    def collect(self, model, pks):
+        """
+        Adds the objects of 'model' with the given primary keys, and their
+        dependents, to the set of objects to hide or unhide.
+        """
+        queue = [(model, pks)]
+        while queue:
+            model, pks = queue.pop(0)
+            collected = self.data.setdefault(model, set())
+            new_pks = set(pks) - collected
+            if not new_pks:
+                continue
+            collected.update(new_pks)
+
+            relations = getattr(model, 'hide_relations', {})
+            for name, policy in relations.items():
+                if policy == HIDE_IGNORE or (policy == HIDE_PROTECT and not self.hidden):
+                    continue
+                if policy not in (HIDE_CASCADE, HIDE_PROTECT):
+                    raise ImproperlyConfigured("Unknown hide policy %r for '%s' on %s"
+                                               % (policy, name, model._meta.object_name))
+
+                related_model, lookup = _related_lookup(model, name)
+                related = related_model._base_manager.using(self.using)
+                related_hidden = hidden_field_name(related_model)
+                if related_hidden:
+                    related = related.filter(**{related_hidden: not self.hidden})
+                elif policy == HIDE_CASCADE:
+                    raise ImproperlyConfigured("Can't cascade hiding from %s to %s, which "
+                                               "is not a hideable model"
+                                               % (model._meta.object_name,
+                                                  related_model._meta.object_name))
+
+                # archived objects can only be found in the archive table
+                archive = getattr(related_model, 'archive_model', None)
+                sources = [related]
+                if archive is not None and not self.hidden:
+                    sources.append(archive._base_manager.using(self.using))
+
+                for batch in pk_batches(new_pks, self.using):
+                    for source in sources:
+                        objs = source.filter(**{'%s__in' % lookup: batch})
+                        if policy == HIDE_PROTECT:
+                            if objs.exists():
+                                raise HideProtectedError(
+                                    "Cannot hide some %s objects because they are "
+                                    "referenced through the protected relation '%s'"
+                                    % (model._meta.object_name, name), objs)
+                        else:
+                            queue.append((related_model,
+                                          objs.values_list('pk', flat=True).distinct()))
+
+    def execute(self):
+        """
+        Hides or unhides the collected objects and returns a dict of the
+        number of objects changed per model.
+        """
+        counts = OrderedDict()
+        with transaction.atomic(using=self.using):
+            for model, pks in self.data.items():
+                counts[model] = set_hidden(model, pks, self.hidden, self.using,
+                                           timestamp=self.timestamp)
+        return counts
@@ -0,0 +1,299 @@
+import collections
+import json
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.paginator import Paginator
+from django.db import connections, models, router, transaction
+from django.db.models import signals
+from django.db.models.lookups import Exact
+from django.utils.functional import cached_property
+
+from model_ninja.db.signals import post_bulk_create, post_bulk_write, post_hide, post_purge
+from model_ninja.db.utils import hidden_field_name
+
+
+Counts = collections.namedtuple('Counts', ['visible', 'hidden'])
+
+# 'group' value for the counts of the whole table
+ALL = object()
+
+_STATE = '_counted_state'
+
+
+def _cache(model):
+    return caches[getattr(model, 'counts_cache', DEFAULT_CACHE_ALIAS)]
+
+
+def _count_by(model):
+    name = getattr(model, 'count_by', None)
+    return model._meta.get_field(name) if name else None
+
+
+def _prefix(model, using):
+    return 'model_ninja:counts:%s:%s:' % (using, model._meta.label_lower)
+
+
+def _group_value(field, value):
+    if isinstance(value, models.Model):
+        value = value.pk
+    if field.is_relation:
+        field = field.target_field
+    return str(field.to_python(value))
+
+
+def _keys(model, using, group):
+    # keys of the visible and hidden counters of the table or of a group. The
+    # group counters are versioned, so they can all be dropped at once
+    prefix = _prefix(model, using)
+    if group is ALL:
+        return prefix + 'visible', prefix + 'hidden'
+    version = _cache(model).get(prefix + 'version', 0)
+    group = _group_value(_count_by(model), group)
+    return ('%sv%s:visible:%s' % (prefix, version, group),
+            '%sv%s:hidden:%s' % (prefix, version, group))
+
+
+def _live_counts(model, using, group):
+    queryset = model._default_manager.db_manager(using).filter(include_hidden=True)
+    if group is not ALL:
+        queryset = queryset.filter(**{_count_by(model).name: group})
+    name = hidden_field_name(model)
+    return Counts(**queryset.aggregate(
+        visible=models.Count('pk', filter=models.Q(**{name: False})),
+        hidden=models.Count('pk', filter=models.Q(**{name: True}))))
+
+
+def get_counts(model, group=ALL, using=None):
+    """
+    Returns the Counts (visible, hidden) of objects of a model with
+    'maintain_counts' set, for the whole table or for one value of the
+    model's 'count_by' field. Counters that aren't cached yet are counted
+    with a single query and cached.
+    """
+    using = using or router.db_for_read(model)
+    cache = _cache(model)
+    keys = _keys(model, using, group)
+    values = cache.get_many(keys)
+    if len(values) == 2:
+        return Counts(values[keys[0]], values[keys[1]])
+    counts = _live_counts(model, using, group)
+    # add rather than set, so counters updated meanwhile are kept
+    cache.add(keys[0], counts.visible, None)
+    cache.add(keys[1], counts.hidden, None)
+    return counts
+
+
+def reconcile_counts(model, using=None):
+    """
+    Recounts the table counters of 'model' and drops its group counters.
+    Returns the (old, new) Counts of the table; old is None if the counters
+    weren't cached.
+    """
+    using = using or router.db_for_write(model)
+    cache = _cache(model)
+    keys = _keys(model, using, ALL)
+    values = cache.get_many(keys)
+    old = Counts(values[keys[0]], values[keys[1]]) if len(values) == 2 else None
+    new = _live_counts(model, using, ALL)
+    cache.set_many(dict(zip(keys, new)), None)
+    _drop_groups(model, using)
+    return old, new
+
+
+def _drop_groups(model, using):
+    if _count_by(model) is None:
+        return
+    cache, key = _cache(model), _prefix(model, using) + 'version'
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def _add(model, using, changes, drop_groups=False):
+    # 'changes' maps (group, hidden) to a change in the number of objects.
+    # Applied on commit, so rolled back changes aren't counted
+    def add():
+        if drop_groups:
+            _drop_groups(model, using)
+        cache = _cache(model)
+        for (group, hidden), delta in changes.items():
+            if not delta:
+                continue
+            key = _keys(model, using, group)[1 if hidden else 0]
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # not cached; counted when next read
+                pass
+    transaction.on_commit(add, using=using)
+
+
+def _state(model, instance):
+    # (hidden, group) of an instance, or None if either field was deferred;
+    # read from __dict__ so deferred fields aren't loaded
+    values = instance.__dict__
+    names = [model._meta.get_field(hidden_field_name(model)).attname]
+    field = _count_by(model)
+    if field is not None:
+        names.append(field.attname)
+    if any(name not in values for name in names):
+        return None
+    return bool(values[names[0]]), values[names[1]] if field is not None else None
+
+
+def track(instance):
+    """
+    Records the current hidden state of a counted instance, after it was
+    changed without a save (e.g. by AbstractHideableModel.hide).
+    """
+    if getattr(type(instance), 'maintain_counts', False):
+        state = _state(type(instance), instance)
+        if state is not None:
+            instance.__dict__[_STATE] = state
+
+
+def _changes(model, old, new):
+    changes = collections.Counter()
+    if old is not None:
+        changes[ALL, old[0]] -= 1
+    if new is not None:
+        changes[ALL, new[0]] += 1
+    if _count_by(model) is not None:
+        if old is not None:
+            changes[old[1], old[0]] -= 1
+        if new is not None:
+            changes[new[1], new[0]] += 1
+    return changes
+
+
+def _on_init(sender, instance, **kwargs):
+    if instance.pk is not None:
+        track(instance)
+
+
+def _on_save(sender, instance, created, using, **kwargs):
+    new = _state(sender, instance)
+    if new is None:
+        return
+    old = None if created else instance.__dict__.get(_STATE, new)
+    instance.__dict__[_STATE] = new
+    if old != new:
+        _add(sender, using, _changes(sender, old, new))
+
+
+def _on_delete(sender, instance, using, **kwargs):
+    old = instance.__dict__.get(_STATE) or _state(sender, instance)
+    if old is None:
+        _on_bulk_write(sender, using)
+    else:
+        _add(sender, using, _changes(sender, old, None))
+
+
+def _on_hide(sender, hidden, count, using, **kwargs):
+    if count:
+        _add(sender, using, {(ALL, hidden): count, (ALL, not hidden): -count},
+             drop_groups=True)
+
+
+def _on_purge(sender, count, using, **kwargs):
+    # purges of the main table send post_delete for every object, which is
+    # counted already, but rows purged from an archive table are not
+    if count and getattr(sender, 'archive_model', None) is not None:
+        _on_bulk_write(sender, using)
+
+
+def _on_bulk_create(sender, objs, using, **kwargs):
+    changes = collections.Counter()
+    for obj in objs:
+        state = _state(sender, obj)
+        changes.update(_changes(sender, None, state))
+        obj.__dict__[_STATE] = state
+    _add(sender, using, changes)
+
+
+def _on_bulk_write(sender, using, **kwargs):
+    # the effect of the write is unknown, so the counters are dropped
+    def drop():
+        _cache(sender).delete_many(_keys(sender, using, ALL))
+        _drop_groups(sender, using)
+    transaction.on_commit(drop, using=using)
+
+
+def connect(model):
+    """
+    Connects the receivers that maintain the counters of 'model'. Done for
+    every model with 'maintain_counts' set when the model class is prepared.
+    As with the object cache, the post_delete receiver makes Django load
+    the objects removed by QuerySet.delete() (and so purge_hidden()) to
+    send post_delete, instead of deleting them with a single query.
+    """
+    uid = 'model_ninja_counts'
+    signals.post_init.connect(_on_init, sender=model, weak=False, dispatch_uid=uid)
+    signals.post_save.connect(_on_save, sender=model, weak=False, dispatch_uid=uid)
+    signals.post_delete.connect(_on_delete, sender=model, weak=False, dispatch_uid=uid)
+    post_hide.connect(_on_hide, sender=model, weak=False, dispatch_uid=uid)
+    post_purge.connect(_on_purge, sender=model, weak=False, dispatch_uid=uid)
+    post_bulk_create.connect(_on_bulk_create, sender=model, weak=False, dispatch_uid=uid)
+    post_bulk_write.connect(_on_bulk_write, sender=model, weak=False, dispatch_uid=uid)
+
+
+def _counted_group(queryset):
+    # Returns ALL for an unfiltered queryset of a counted model, the value of
+    # the 'count_by' field for a queryset only filtered on it, and None for
+    # querysets the counters can't answer
+    query = queryset.query
+    model = queryset.model
+    if (not getattr(model, 'maintain_counts', False) or query.distinct or query.combinator
+            or query.low_mark or query.high_mark is not None or len(query.alias_map) > 1):
+        return None
+    where = query.where
+    if not where.children:
+        return ALL
+    field = _count_by(model)
+    if field is None or len(where.children) != 1 or where.negated:
+        return None
+    lookup = where.children[0]
+    if (isinstance(lookup, Exact) and getattr(lookup.lhs, 'target', None) == field
+            and not hasattr(lookup.rhs, 'resolve_expression')):
+        return lookup.rhs
+    return None
+
+
+def estimated_count(queryset):
+    """
+    Returns the query planner's estimate of the number of objects in
+    'queryset' on PostgreSQL, which costs an EXPLAIN rather than a scan, or
+    None on other databases.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    # a list of plans, unless the driver already decoded the JSON column and
+    # Django serialized the single plan again
+    if isinstance(plan, list):
+        plan = plan[0]
+    return int(plan['Plan']['Plan Rows'])
+
+
+class CountedPaginator(Paginator):
+    """
+    Paginator that takes the object count of querysets of models with
+    'maintain_counts' from the maintained counters instead of a COUNT query.
+    Other querysets, and querysets filtered on anything but the 'count_by'
+    field, are counted as usual.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        group = _counted_group(queryset) if hasattr(queryset, 'includes_hidden') else None
+        if group is None:
+            return self._count_query()
+        counts = get_counts(queryset.model, group, using=queryset.db)
+        if queryset.includes_hidden:
+            return counts.visible + counts.hidden
+        return counts.visible
+    
+    def _count_query(self):
+        # count of querysets the counters can't answer
+        return super(CountedPaginator, self).count
@@ -0,0 +1,175 @@
+import functools
+import logging
+import threading
+import time
+
+from django.db import connections, router
+from django.dispatch import Signal
+
+
+# sent with the model as sender and a ManagerCall as 'call'
+manager_call = Signal()
+
+
+class _State(threading.local):
+    depth = 0
+
+_state = _State()
+_enabled = False
+_count_hidden = False
+_sinks = []
+
+
+class ManagerCall(object):
+    """
+    Measurements of one instrumented manager call.
+
+    'hidden_filtered' is 1 if a 'get' that found nothing would have found an
+    object had hidden objects been included, and 0 otherwise. It is only
+    checked when instrumentation was enabled with 'count_hidden=True', since
+    it costs an extra query (not included in 'queries') for every such
+    'get'. 'hidden_error' is True if the call raised a HiddenObjectError,
+    and 'error' is the exception class for any other error.
+    """
+    def __init__(self, model, method, using):
+        self.model = model
+        self.method = method
+        self.using = using
+        self.queries = 0
+        self.duration = 0.0
+        self.hidden_filtered = 0
+        self.hidden_error = False
+        self.error = None
+
+    def __repr__(self):
+        return '<ManagerCall: %s.%s, %d queries, %.2f ms>' % (
+            self.model._meta.label, self.method, self.queries, self.duration * 1000)
+
+
+def enable(*sinks, **kwargs):
+    """
+    Turns on instrumentation of HideableModelManager calls ('get',
+    'get_or_create', 'hide', 'unhide', 'purge_hidden', 'archive_hidden' and
+    their async versions) and connects the given sinks to the 'manager_call'
+    signal, which is sent with a ManagerCall after every call, e.g.:
+
+        instrumentation.enable(LoggingSink(), StatsSink(statsd.timing))
+
+    Pass count_hidden=True to also flag 'get' calls that missed only because
+    of hidden objects. While disabled (the default), instrumented methods
+    only check a flag.
+    
+    Only these manager methods are instrumented. Querysets returned by
+    'filter', 'all' and the like run their queries when they are evaluated,
+    outside of any manager call, and are not recorded.
+    """
+    global _enabled, _count_hidden
+    for sink in sinks:
+        manager_call.connect(sink, weak=False)
+        _sinks.append(sink)
+    _count_hidden = kwargs.get('count_hidden', False)
+    _enabled = True
+
+
+def disable():
+    """
+    Turns off instrumentation and disconnects the sinks passed to 'enable'.
+    """
+    global _enabled, _count_hidden
+    _enabled = _count_hidden = False
+    while _sinks:
+        manager_call.disconnect(_sinks.pop())
+
+
+def is_enabled():
+    return _enabled
+
+
+def instrumented(method=None, writes=False):
+    """
+    Decorator for HideableModelManager methods that records a ManagerCall
+    while instrumentation is enabled. Calls made from inside an instrumented
+    call (e.g. the 'get' done by 'get_or_create') are part of the outer call.
+    Methods that write are decorated with '@instrumented(writes=True)', so
+    their queries are counted on the database the router picks for writes.
+    """
+    if method is None:
+        return functools.partial(instrumented, writes=writes)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not _enabled or _state.depth:
+            return method(self, *args, **kwargs)
+        from model_ninja.db.models import HiddenObjectError
+
+        if writes:
+            using = self._db or router.db_for_write(self.model, **self._hints)
+        else:
+            using = self.db
+        call = ManagerCall(self.model, method.__name__, using)
+
+        def count_queries(execute, sql, params, many, context):
+            call.queries += 1
+            return execute(sql, params, many, context)
+
+        _state.depth += 1
+        start = time.perf_counter()
+        try:
+            with connections[using].execute_wrapper(count_queries):
+                return method(self, *args, **kwargs)
+        except HiddenObjectError:
+            call.hidden_error = True
+            raise
+        except self.model.DoesNotExist as e:
+            call.error = e.__class__
+            if _count_hidden and not kwargs.get('include_hidden'):
+                kwargs['include_hidden'] = True
+                call.hidden_filtered = int(self.filter(*args, **kwargs).exists())
+            raise
+        except Exception as e:
+            call.error = e.__class__
+            raise
+        finally:
+            call.duration = time.perf_counter() - start
+            _state.depth -= 1
+            manager_call.send(sender=self.model, call=call)
+    return wrapper
+
+
+class LoggingSink(object):
+    """
+    Logs every ManagerCall, by default to the 'model_ninja.instrumentation'
+    logger at DEBUG level.
+    """
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('model_ninja.instrumentation')
+        self.level = level
+
+    def __call__(self, sender, call, **kwargs):
+        self.logger.log(self.level, '%s.%s: %d queries, %.2f ms, %d hidden filtered%s',
+                        sender._meta.label, call.method, call.queries,
+                        call.duration * 1000, call.hidden_filtered,
+                        ', HiddenObjectError' if call.hidden_error else '')
+
+
+class StatsSink(object):
+    """
+    Reports ManagerCalls to a statsd-style 'callback(name, value)' as metrics
+    named '<prefix>.<app_label>.<model>.<method>.<metric>': 'calls',
+    'queries', 'time' (milliseconds), 'hidden_filtered' and 'hidden_errors'.
+    Counts of zero are not reported.
+    """
+    def __init__(self, callback, prefix='model_ninja'):
+        self.callback = callback
+        self.prefix = prefix
+
+    def __call__(self, sender, call, **kwargs):
+        name = '%s.%s.%s.%s' % (self.prefix, sender._meta.app_label,
+                                sender._meta.model_name, call.method)
+        self.callback('%s.calls' % name, 1)
+        self.callback('%s.time' % name, call.duration * 1000)
+        for metric, value in (('queries', call.queries),
+                              ('hidden_filtered', call.hidden_filtered),
+                              ('hidden_errors', int(call.hidden_error))):
+            if value:
+                self.callback('%s.%s' % (name, metric), value)
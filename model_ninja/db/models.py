@@ -1,13 +1,495 @@
-from django.db import models, IntegrityError
+import datetime
+import functools
+import itertools
+import operator
 
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connections, models, router, transaction, IntegrityError
+from django.db.models import signals, sql
+from django.utils import timezone
 
-class HideableModelManager(models.Manager):
+from model_ninja.db.archive import (check_references, include_archive, make_archive_model,
+                                    move_rows, set_hidden, update_archived, ARCHIVE_ON_HIDE,
+                                    ARCHIVE_ON_SWEEP)
+from model_ninja.db import counts, outbox
+from model_ninja.db.cache import connect as connect_cache, default_cache
+from model_ninja.db.instrumentation import instrumented
+from model_ninja.db.options import hideable_options, HideableOptions
+from model_ninja.db.signals import post_bulk_create, post_bulk_write, post_hide, post_purge
+from model_ninja.db.utils import hidden_values
+from model_ninja.db.views import read_from_view
+from model_ninja.db.cascade import (HideCollector, HideProtectedError, HIDE_CASCADE,
+                                    HIDE_IGNORE, HIDE_PROTECT)
+
+
+class HideableQuery(sql.Query):
+    """
+    Query that adds the "hidden field is False" predicate when it is compiled,
+    unless 'include_hidden' is set. Deferring the predicate to compile time
+    means it appears exactly once in the SQL no matter how the queryset was
+    chained, and it also applies when the query is used as a subquery, counted,
+    aggregated or checked for existence. Those operations already copy the
+    query, and the predicate is added to their copy; a query compiled for a
+    SELECT is copied once for it.
+    
+    For models with an archive table, queries that include hidden objects
+    read from the main and archive tables combined (see ArchiveUnionTable).
+    For models with a 'visible_view', queries that exclude hidden objects
+    read from the view instead of adding the predicate (see
+    VisibleViewTable); updates and deletes always go to the table.
+    """
+    hidden_field_name = None
+    include_hidden = False
+    hidden_prepared = False
+    
+    def _apply_hidden_filter(self):
+        # Adds the predicate in place, for writes to the main table
+        if self.hidden_field_name and not self.hidden_prepared:
+            if not self.include_hidden:
+                self.add_q(models.Q(**{self.hidden_field_name: False}))
+            self.hidden_prepared = True
+    
+    def _prepare_hidden(self):
+        # Prepares the query in place for reading
+        if not self.hidden_field_name or self.hidden_prepared:
+            return
+        if self.include_hidden:
+            if getattr(self.model, 'archive_model', None) is not None:
+                include_archive(self)
+        elif read_from_view(self):
+            self.hidden_prepared = True
+            return
+        self._apply_hidden_filter()
+    
+    def clone(self):
+        obj = super(HideableQuery, self).clone()
+        obj.__dict__.pop('_prepared_clone', None)
+        return obj
+    
+    def __getstate__(self):
+        state = super(HideableQuery, self).__getstate__()
+        state.pop('_prepared_clone', None)
+        return state
+    
+    # COUNT, EXISTS, aggregate() and subqueries already work on a copy of
+    # the query made for the one operation, which is prepared in place
+    
+    def exists(self, *args, **kwargs):
+        query = super(HideableQuery, self).exists(*args, **kwargs)
+        query._prepare_hidden()
+        return query
+    
+    def get_aggregation(self, using, aggregate_exprs):
+        self._prepare_hidden()
+        return super(HideableQuery, self).get_aggregation(using, aggregate_exprs)
+    
+    def resolve_expression(self, *args, **kwargs):
+        query = super(HideableQuery, self).resolve_expression(*args, **kwargs)
+        query._prepare_hidden()
+        return query
+    
+    def get_compiler(self, *args, **kwargs):
+        # Querysets may still be chained from this query, so the predicate
+        # goes on a copy, made once and kept for later compiles of the query
+        if self.hidden_field_name and not self.hidden_prepared:
+            query = self.__dict__.get('_prepared_clone')
+            if query is None:
+                query = self._prepared_clone = self.clone()
+                query._prepare_hidden()
+            return query.get_compiler(*args, **kwargs)
+        return super(HideableQuery, self).get_compiler(*args, **kwargs)
+
+
+class HideableQuerySet(models.QuerySet):
+    """
+    QuerySet returned by HideableModelManager. Hidden objects are excluded 
+    unless the queryset was told to include them, either with 
+    'include_hidden()' or by passing 'include_hidden=True' to 'all', 'filter', 
+    'exclude' or 'get'. Filtering on the hidden field itself (e.g. 
+    deleted=True) also turns off the implicit hidden filter for that queryset.
+    
+    The include-hidden state is tracked on the underlying query and the 
+    predicate is only added when the SQL is compiled, so chained calls, 
+    'count', 'exists', 'values', 'aggregate', 'in_bulk', 'iterator', 'update' 
+    and 'delete' all see the same set of objects.
+    
+    Also adds bulk operations that hide, unhide or permanently delete hidden 
+    objects with set-based UPDATE/DELETE statements instead of loading and 
+    saving each instance. Every bulk method takes an optional 'chunk_size'. 
+    When given, the rows are processed in primary key order, 'chunk_size' rows 
+    per statement, so that each statement only locks a bounded number of rows. 
+    Outside a transaction every batch is committed on its own.
+    
+    Use 'as_manager()' to get a HideableModelManager for a subclass; set 
+    'hidden_field_name' on the subclass for a custom hidden field.
+    """
+    hidden_field_name = "deleted"
+    hidden_at_field_name = None
+    
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        if query is None:
+            query = HideableQuery(model)
+            query.hidden_field_name = self.hidden_field_name
+            options = hideable_options(model) if model is not None else None
+            if options is not None and options.include_hidden:
+                query.include_hidden = True
+        super(HideableQuerySet, self).__init__(model=model, query=query, 
+                                               using=using, hints=hints)
+    
+    @classmethod
+    def as_manager(cls):
+        # The field names are set on the manager class, since related
+        # managers are created by subclassing the default manager's class
+        manager_class = HideableModelManager.from_queryset(cls)
+        manager_class.hidden_field_name = cls.hidden_field_name
+        manager_class.hidden_at_field_name = cls.hidden_at_field_name
+        manager = manager_class()
+        manager._built_with_as_manager = True
+        return manager
+    as_manager.queryset_only = True
+    
+    def _clone(self):
+        clone = super(HideableQuerySet, self)._clone()
+        clone.hidden_field_name = self.hidden_field_name
+        clone.hidden_at_field_name = self.hidden_at_field_name
+        return clone
+    
+    def _hidden_lookups(self):
+        # the lookups on the hidden field, resolved once per model
+        options = hideable_options(self.model) if self.model is not None else None
+        if options is not None and options.hidden_field_name == self.hidden_field_name:
+            return options.hidden_lookups
+        return (self.hidden_field_name,)
+    
+    def _pop_include_hidden(self, kwargs):
+        # Same rules as HideableModelManager._kwargs_for_query, but returns
+        # the include-hidden state for the resulting queryset instead of
+        # adding the hidden field to the lookups
+        include_hidden = kwargs.pop('include_hidden', None)
+        if kwargs and any(lookup in kwargs for lookup in self._hidden_lookups()):
+            if include_hidden is False:
+                kwargs[self.hidden_field_name] = False
+            include_hidden = True
+        return include_hidden
+    
+    def _with_include_hidden(self, include_hidden):
+        if include_hidden is not None:
+            self.query.include_hidden = include_hidden
+        return self
+    
+    @property
+    def includes_hidden(self):
+        """ True if hidden objects are not filtered out of this queryset. """
+        return self.query.include_hidden
+    
+    def include_hidden(self, include=True):
+        """
+        Returns a copy of this queryset that includes hidden objects (or, with
+        include=False, excludes them again).
+        """
+        return self._chain()._with_include_hidden(bool(include))
+    
+    def all(self, include_hidden=None):
+        return super(HideableQuerySet, self).all()._with_include_hidden(include_hidden)
+    
+    def filter(self, *args, **kwargs):
+        include_hidden = self._pop_include_hidden(kwargs)
+        queryset = super(HideableQuerySet, self).filter(*args, **kwargs)
+        return queryset._with_include_hidden(include_hidden)
+    
+    def exclude(self, *args, **kwargs):
+        include_hidden = kwargs.pop('include_hidden', None)
+        queryset = super(HideableQuerySet, self).exclude(*args, **kwargs)
+        return queryset._with_include_hidden(include_hidden)
+    
+    def _with_hidden_filter(self):
+        # Update and delete queries are compiled from a plain UpdateQuery or
+        # DeleteQuery, so the predicate has to be added to the query up front
+        queryset = self._chain()
+        queryset.query._apply_hidden_filter()
+        return queryset
+    
+    def update(self, **kwargs):
+        count = super(HideableQuerySet, self._with_hidden_filter()).update(**kwargs)
+        post_bulk_write.send(sender=self.model, pks=None, using=self.db)
+        return count
+    update.alters_data = True
+    
+    def _update(self, values):
+        return super(HideableQuerySet, self._with_hidden_filter())._update(values)
+    _update.alters_data = True
+    
+    def _raw_delete(self, using):
+        return super(HideableQuerySet, self._with_hidden_filter())._raw_delete(using)
+    _raw_delete.alters_data = True
+    
+    def bulk_update(self, objs, fields, batch_size=None):
+        # The objects are given explicitly, so like Model.save() this updates
+        # them whether or not they are hidden
+        count = super(HideableQuerySet, self.include_hidden()).bulk_update(
+                    objs, fields, batch_size=batch_size)
+        post_bulk_write.send(sender=self.model, pks=[obj.pk for obj in objs], using=self.db)
+        return count
+    bulk_update.alters_data = True
+    
+    def bulk_create(self, objs, batch_size=None, ignore_conflicts=False,
+                    update_conflicts=False, update_fields=None, unique_fields=None):
+        objs = super(HideableQuerySet, self).bulk_create(
+                    objs, batch_size=batch_size, ignore_conflicts=ignore_conflicts,
+                    update_conflicts=update_conflicts, update_fields=update_fields,
+                    unique_fields=unique_fields)
+        if ignore_conflicts or update_conflicts:
+            post_bulk_write.send(sender=self.model, pks=None, using=self.db)
+        else:
+            post_bulk_create.send(sender=self.model, objs=objs, using=self.db)
+        return objs
+    bulk_create.alters_data = True
+    
+    @property
+    def _archive_model(self):
+        return getattr(self.model, 'archive_model', None)
+    
+    @property
+    def _outbox_model(self):
+        return getattr(self.model, 'outbox_model', None)
+    
+    def _base_queryset(self):
+        return self.model._base_manager.db_manager(self.db).all()
+    
+    def _pk_batches(self, chunk_size):
+        # Keyset pagination over the primary keys matching this queryset. The
+        # query is re-run after each batch, so rows changed by a previous
+        # batch drop out of the results rather than shifting the offsets.
+        pks = self.order_by('pk').values_list('pk', flat=True)
+        last_pk = None
+        while True:
+            batch = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+            batch = list(batch[:chunk_size])
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1]
+    
+    def _set_hidden(self, hidden, chunk_size, cascade=False):
+        # Flips the hidden field for rows that don't already have the value.
+        # A queryset that excludes hidden objects has nothing to unhide and
+        # already restricts itself to visible objects for hiding.
+        lookup = {self.hidden_field_name: not hidden}
+        # one timestamp for every batch of the operation
+        timestamp = timezone.now()
+        values = hidden_values(self.model, hidden, timestamp)
+        if not self.includes_hidden:
+            if not hidden:
+                return 0
+            queryset = self._chain()
+        else:
+            queryset = super(HideableQuerySet, self).filter(**lookup)
+        queryset._for_write = True
+        # the archive and the outbox both need the primary keys
+        if cascade or self._archive_model is not None or self._outbox_model is not None:
+            return queryset._set_hidden_by_pk(hidden, chunk_size, cascade, timestamp)
+        if not chunk_size:
+            # QuerySet.update, without the post_bulk_write signal
+            count = super(HideableQuerySet, queryset._with_hidden_filter()).update(**values)
+            post_hide.send(sender=self.model, pks=None, hidden=hidden, count=count,
+                           using=self.db)
+            return count
+        count = 0
+        for batch in queryset._pk_batches(chunk_size):
+            changed = self._base_queryset().filter(pk__in=batch, **lookup).update(**values)
+            post_hide.send(sender=self.model, pks=batch, hidden=hidden, count=changed,
+                           using=self.db)
+            count += changed
+        return count
+    
+    def _batches(self, chunk_size):
+        if chunk_size:
+            return self._pk_batches(chunk_size)
+        return [list(self.values_list('pk', flat=True))]
+    
+    def _set_hidden_by_pk(self, hidden, chunk_size, cascade, timestamp):
+        # Used for cascades, archive tables and outboxes, which need the
+        # primary keys; a cascade runs one HideCollector (and transaction) per
+        # batch, and set_hidden one transaction per batch
+        count = 0
+        for batch in self._batches(chunk_size):
+            if cascade:
+                collector = HideCollector(self.db, hidden=hidden, timestamp=timestamp)
+                collector.collect(self.model, batch)
+                count += collector.execute()[self.model]
+            else:
+                count += set_hidden(self.model, batch, hidden, self.db, timestamp=timestamp)
+        return count
+    
+    def hide(self, chunk_size=None, cascade=False):
+        """
+        Hides every visible object in the queryset with a single UPDATE (or
+        one UPDATE per batch if 'chunk_size' is given). Returns the number of
+        objects hidden. With cascade=True, dependents are hidden as well
+        according to the model's 'hide_relations' (see HideCollector).
+        """
+        return self._set_hidden(True, chunk_size, cascade)
+    hide.alters_data = True
+    
+    def unhide(self, chunk_size=None, cascade=False):
+        """
+        Restores every hidden object in the queryset with a single UPDATE (or
+        one UPDATE per batch if 'chunk_size' is given). Returns the number of
+        objects restored. Note that querysets from the manager exclude hidden
+        objects unless 'include_hidden=True' was used. With cascade=True, 
+        hidden dependents are restored as well.
+        """
+        return self._set_hidden(False, chunk_size, cascade)
+    unhide.alters_data = True
+    
+    def purge_hidden(self, older_than=None, chunk_size=None):
+        """
+        Permanently deletes the hidden objects in the queryset. 'older_than'
+        (a datetime, or a timedelta counted back from now) limits the purge to
+        objects hidden before that time and requires the manager to define
+        'hidden_at_field_name'. Returns the number of objects deleted.
+        
+        Deletion goes through QuerySet.delete, so it is a single DELETE per
+        batch unless the model has delete signals or cascading relations.
+        Models with 'maintain_counts' or 'cache_objects' have a post_delete
+        receiver, so their objects are loaded before they are deleted.
+        """
+        if not self.includes_hidden:
+            return 0
+        queryset = super(HideableQuerySet, self).filter(**{self.hidden_field_name: True})
+        if older_than is not None:
+            if not self.hidden_at_field_name:
+                raise FieldDoesNotExist("%s has no hidden timestamp field to compare "
+                                        "'older_than' against"
+                                        % self.model._meta.object_name)
+            if isinstance(older_than, datetime.timedelta):
+                older_than = timezone.now() - older_than
+            queryset = queryset.filter(**{'%s__lt' % self.hidden_at_field_name: older_than})
+        
+        queryset._for_write = True
+        archive = self._archive_model
+        if not chunk_size and archive is None:
+            count = queryset.delete()[0]
+            post_purge.send(sender=self.model, pks=None, count=count, using=self.db)
+            return count
+        count = 0
+        for batch in queryset._batches(chunk_size):
+            deleted = self._base_queryset().filter(pk__in=batch).delete()[0]
+            if archive is not None:
+                deleted += archive._base_manager.db_manager(self.db).filter(
+                               pk__in=batch).delete()[0]
+            post_purge.send(sender=self.model, pks=batch, count=deleted, using=self.db)
+            count += deleted
+        return count
+    purge_hidden.alters_data = True
+    
+    def archive_hidden(self, chunk_size=None):
+        """
+        Moves the hidden objects in the queryset that are still in the main
+        table to the model's archive table, 'chunk_size' objects per batch if
+        given. Returns the number of objects moved. Only models with an 
+        'archive_mode' have an archive table.
+        """
+        archive = self._archive_model
+        if archive is None:
+            raise ImproperlyConfigured("%s has no archive table; set 'archive_mode' "
+                                       "on the model" % self.model._meta.object_name)
+        if not self.includes_hidden:
+            return 0
+        queryset = super(HideableQuerySet, self).filter(**{self.hidden_field_name: True})
+        queryset._for_write = True
+        count = 0
+        for batch in queryset._batches(chunk_size):
+            count += move_rows(self.model, archive, batch, self.db)
+        return count
+    archive_hidden.alters_data = True
+    
+    def _stream_rows(self, include_hidden, only_fields):
+        if self.query.is_sliced:
+            raise TypeError("Cannot stream a sliced queryset")
+        queryset = self._chain()._with_include_hidden(include_hidden).order_by('pk')
+        if only_fields is not None:
+            queryset = queryset.values_list('pk', *(list(only_fields) + 
+                                                    [self.hidden_field_name]))
+        return queryset
+    
+    def _stream_chunk(self, rows, last_pk, chunk_size):
+        # Keyset pagination like _pk_batches, but over whole rows
+        if last_pk is not None:
+            rows = rows.filter(pk__gt=last_pk)
+        return rows[:chunk_size]
+    
+    def stream(self, include_hidden=None, chunk_size=1000, only_fields=None,
+               start_after=None):
+        """
+        Iterates over the objects in the queryset in primary key order, one
+        query per 'chunk_size' objects, without caching them, so memory use
+        doesn't depend on the size of the table. Each chunk is read with
+        QuerySet.iterator, which uses a server-side cursor where the database
+        supports it. 'include_hidden' overrides the queryset's own setting.
+        
+        Yields model instances, or, if 'only_fields' is given, tuples of the
+        primary key, the values of those fields and the hidden flag. Pass
+        the primary key of the last object processed as 'start_after' to
+        resume an interrupted stream.
+        """
+        rows = self._stream_rows(include_hidden, only_fields)
+        last_pk = start_after
+        while True:
+            count = 0
+            for row in self._stream_chunk(rows, last_pk, chunk_size).iterator(chunk_size):
+                count += 1
+                last_pk = row.pk if only_fields is None else row[0]
+                yield row
+            if count < chunk_size:
+                return
+    
+    # Async counterparts, following QuerySet's own async methods. The async
+    # read methods inherited from QuerySet (aget, acount, aexists, async for,
+    # ...) go through this queryset's 'filter' and hidden predicate already.
+    
+    async def ahide(self, chunk_size=None, cascade=False):
+        return await sync_to_async(self.hide)(chunk_size=chunk_size, cascade=cascade)
+    ahide.alters_data = True
+    
+    async def aunhide(self, chunk_size=None, cascade=False):
+        return await sync_to_async(self.unhide)(chunk_size=chunk_size, cascade=cascade)
+    aunhide.alters_data = True
+    
+    async def apurge_hidden(self, older_than=None, chunk_size=None):
+        return await sync_to_async(self.purge_hidden)(older_than=older_than,
+                                                      chunk_size=chunk_size)
+    apurge_hidden.alters_data = True
+    
+    async def aarchive_hidden(self, chunk_size=None):
+        return await sync_to_async(self.archive_hidden)(chunk_size=chunk_size)
+    aarchive_hidden.alters_data = True
+    
+    async def astream(self, include_hidden=None, chunk_size=1000, only_fields=None,
+                      start_after=None):
+        rows = self._stream_rows(include_hidden, only_fields)
+        last_pk = start_after
+        while True:
+            count = 0
+            chunk = self._stream_chunk(rows, last_pk, chunk_size)
+            async for row in chunk.aiterator(chunk_size):
+                count += 1
+                last_pk = row.pk if only_fields is None else row[0]
+                yield row
+            if count < chunk_size:
+                return
+
+
+class HideableModelManager(models.Manager.from_queryset(HideableQuerySet)):
     """ 
     A model manager to allow hiding or 'deleting' objects for a given Model 
     without actually removing them from the database. Overrides the regular 
     query methods ('get', 'filter', 'all') to automatically ignore any 
     hidden/deleted objects. The 'include_hidden' can be passed to any of the
-    three methods to include these hidden objects as part of the query.
+    three methods to include these hidden objects as part of the query. The
+    querysets returned are HideableQuerySets, which keep excluding hidden
+    objects through further chaining.
     
     To use this Manager, simply create a Model that extends 
     AbstractHideableModel below. If you want to write your own Model that has
@@ -25,24 +507,83 @@ class HideableModelManager(models.Manager):
        
        This behavior can be overridden by explicitly including the hidden field 
        as part of the lookup params (e.g. deleted=True) or the defaults.
+       'bulk_get_or_create' reports these objects as BULK_HIDDEN instead.
     
     2) Be aware of 'get' and 'get_or_create' and uniqueness constraints. It 
        is possible to have IntegrityErrors/ValidationErrors or 
        MultipleObjectsReturned errors when hidden objects exist but aren't 
        showing up in normal queries. 
+       Declaring the fields in 'visible_unique' on the model instead makes
+       them unique among visible objects only; see AbstractHideableModel.
        
     3) If the 'include_hidden' param is specified and it conflicts with the 
        actual hidden field's lookup value (e.g., include_hidden=False and 
        deleted=True), 'include_hidden' may override the hidden field lookup
        value.
     
+    4) Objects can be hidden, restored, or purged in bulk with 'hide', 
+       'unhide' and 'purge_hidden', which are also available on the returned 
+       querysets. Set 'hidden_at_field_name' to the name of a DateTimeField 
+       recording when objects were hidden to use 'purge_hidden(older_than=...)'.
+    
+    5) Reverse foreign key and many-to-many managers (e.g. author.books) and
+       prefetch_related are built from this manager, so they exclude hidden 
+       objects in SQL too. Use author.books.all(include_hidden=True), or 
+       Prefetch('books', queryset=Book.objects.include_hidden()), to include 
+       them. Forward foreign keys and reverse one-to-one accessors use the 
+       model's base manager and return the related object even if hidden.
+    
+    6) Every method here has an async counterpart ('aget', 'aget_or_create',
+       'ahide', ...), as does every queryset method; 'acount', 'aexists' and 
+       'async for' work on the returned querysets. They apply the same rules
+       for hidden objects as the sync methods.
+    
+    7) Call counts, query counts and timings of 'get', 'get_or_create' and
+       the hide, unhide, purge and archive methods can be collected with
+       model_ninja.db.instrumentation (off by default). Querysets returned
+       by 'filter' or 'all' are not instrumented.
+    
+    8) 'get_cached' and 'in_bulk_cached' look objects up by primary key
+       through the cache tiers of model_ninja.db.cache.ObjectCache, which are
+       invalidated when objects are saved, hidden or unhidden. The model has
+       to set 'cache_objects'; see AbstractHideableModel.
+    
+    9) With 'maintain_counts' set on the model, 'counts' returns visible and
+       hidden totals from counters kept up to date by saves, deletes and the
+       bulk methods; see AbstractHideableModel.
+    
+    10) Exports and other jobs that read whole tables should use 'stream'
+        (or 'astream'), which walks the objects in primary key order one
+        chunk at a time and can be resumed from a primary key.
+    
     """
     hidden_field_name = "deleted"
+    hidden_at_field_name = None
+    object_cache = None
+    
+    def get_queryset(self):
+        queryset = super(HideableModelManager, self).get_queryset()
+        queryset.hidden_field_name = self.hidden_field_name
+        queryset.hidden_at_field_name = self.hidden_at_field_name
+        queryset.query.hidden_field_name = self.hidden_field_name
+        return queryset
+    
+    def check(self, **kwargs):
+        errors = super(HideableModelManager, self).check(**kwargs)
+        opts = self.model._meta
+        if (self is opts.default_manager and not opts.proxy and
+                getattr(self.model, 'archive_model', None) is not None):
+            errors.extend(check_references(self.model))
+        return errors
     
     def _kwargs_for_query(self, kwargs):
         # filter out objects with the flag indicating that they should be 
-        # hidden, unless specified otherwise
-        add_hidden_param = not self.hidden_field_name in kwargs
+        # hidden, unless specified otherwise. The manager's querysets track
+        # this as state instead (see HideableQuerySet); this is kept for
+        # code that builds lookups for other querysets.
+        options = hideable_options(self.model)
+        add_hidden_param = not (self.hidden_field_name in kwargs or
+                                (options is not None and options.include_hidden))
         if 'include_hidden' in kwargs:
             add_hidden_param = not kwargs.pop('include_hidden')
         
@@ -50,34 +591,136 @@ class HideableModelManager(models.Manager):
             kwargs[self.hidden_field_name] = False
         return kwargs
     
-    def all(self, include_hidden=False):
+    def all(self, include_hidden=None):
         """ 
         Custom all method that excludes hidden objects by default. If the
         'include_hidden' kwarg is passed and is True, hidden objects will also
-        be included in the query.
+        be included in the query (and excluded if it is False, for models
+        that include them by default).
         """
-        if include_hidden:
-            return super(HideableModelManager, self).all()
-        return self.filter()
+        # Like Manager.all, returns get_queryset() as-is where possible so
+        # related managers keep serving their prefetch_related cache
+        queryset = self.get_queryset()
+        if include_hidden is not None and bool(include_hidden) != queryset.includes_hidden:
+            return queryset.include_hidden(include_hidden)
+        return queryset
     
-    def filter(self, **kwargs):
+    def filter(self, *args, **kwargs):
         """ 
         Custom filter method that excludes hidden objects by default. If the 
         'include_hidden' kwarg is passed and is True, hidden objects will also 
         be included in the query.
         """
-        kwargs = self._kwargs_for_query(kwargs)
-        return super(HideableModelManager, self).filter(**kwargs)
+        return self.get_queryset().filter(*args, **kwargs)
     
-    def get(self, **kwargs):
+    @instrumented
+    def get(self, *args, **kwargs):
         """ 
         Custom get method that excludes hidden objects by default. If
         the 'include_hidden' kwarg is passed and is True, hidden objects will
         also be included when running the 'get' method.
         """
-        kwargs = self._kwargs_for_query(kwargs)
-        return super(HideableModelManager, self).get(**kwargs)
+        return self.get_queryset().get(*args, **kwargs)
+    
+    def counts(self, group=counts.ALL):
+        """
+        Returns the maintained Counts (visible, hidden) of objects, for the
+        whole table or for one value of the model's 'count_by' field. The
+        model must set 'maintain_counts'; see model_ninja.db.counts.
+        """
+        if not getattr(self.model, 'maintain_counts', False):
+            raise ImproperlyConfigured("%s doesn't maintain counts; set 'maintain_counts' "
+                                       "on the model" % self.model._meta.object_name)
+        return counts.get_counts(self.model, group, using=self.db)
+    
+    def get_cached(self, pk, include_hidden=False):
+        """
+        Cached version of 'get(pk=pk)', using the manager's 'object_cache'
+        (an ObjectCache, model_ninja.db.cache.default_cache if not set) on
+        models with 'cache_objects'. Hidden objects raise DoesNotExist unless
+        'include_hidden' is True.
+        """
+        objs = self.in_bulk_cached([pk], include_hidden=include_hidden)
+        if not objs:
+            raise self.model.DoesNotExist("%s matching query does not exist."
+                                          % self.model._meta.object_name)
+        return list(objs.values())[0]
+    
+    def in_bulk_cached(self, pks, include_hidden=False):
+        """
+        Cached version of 'in_bulk(pks)'; see 'get_cached'.
+        """
+        cache = self.object_cache or default_cache
+        return cache.get_many(self, pks, include_hidden=include_hidden)
+    
+    @instrumented(writes=True)
+    def hide(self, chunk_size=None, cascade=False, **kwargs):
+        """
+        Hides all visible objects matching the lookup params with a single
+        UPDATE, or in batches of 'chunk_size' objects. Returns the number of
+        objects hidden. See HideableQuerySet.hide for 'cascade'.
+        """
+        return self.filter(**kwargs).hide(chunk_size=chunk_size, cascade=cascade)
+    hide.alters_data = True
+    
+    @instrumented(writes=True)
+    def unhide(self, chunk_size=None, cascade=False, **kwargs):
+        """
+        Restores all hidden objects matching the lookup params with a single
+        UPDATE, or in batches of 'chunk_size' objects. Returns the number of
+        objects restored. See HideableQuerySet.unhide for 'cascade'.
+        """
+        return self.filter(include_hidden=True, **kwargs).unhide(chunk_size=chunk_size,
+                                                                 cascade=cascade)
+    unhide.alters_data = True
+    
+    @instrumented(writes=True)
+    def purge_hidden(self, older_than=None, chunk_size=None, **kwargs):
+        """
+        Permanently deletes hidden objects matching the lookup params. See
+        HideableQuerySet.purge_hidden for 'older_than' and 'chunk_size'.
+        Returns the number of objects deleted.
+        """
+        return self.filter(include_hidden=True, **kwargs).purge_hidden(
+                older_than=older_than, chunk_size=chunk_size)
+    purge_hidden.alters_data = True
+    
+    @instrumented(writes=True)
+    def archive_hidden(self, chunk_size=None, **kwargs):
+        """
+        Moves hidden objects matching the lookup params to the archive table.
+        See HideableQuerySet.archive_hidden. Returns the number of objects
+        moved.
+        """
+        return self.filter(include_hidden=True, **kwargs).archive_hidden(chunk_size=chunk_size)
+    archive_hidden.alters_data = True
+    
+    async def aget(self, *args, **kwargs):
+        """
+        Async version of 'get', with the same handling of hidden objects.
+        """
+        return await sync_to_async(self.get)(*args, **kwargs)
+    
+    async def ahide(self, chunk_size=None, cascade=False, **kwargs):
+        return await sync_to_async(self.hide)(chunk_size=chunk_size, cascade=cascade,
+                                              **kwargs)
+    ahide.alters_data = True
+    
+    async def aunhide(self, chunk_size=None, cascade=False, **kwargs):
+        return await sync_to_async(self.unhide)(chunk_size=chunk_size, cascade=cascade,
+                                                **kwargs)
+    aunhide.alters_data = True
+    
+    async def apurge_hidden(self, older_than=None, chunk_size=None, **kwargs):
+        return await sync_to_async(self.purge_hidden)(older_than=older_than,
+                                                      chunk_size=chunk_size, **kwargs)
+    apurge_hidden.alters_data = True
+    
+    async def aarchive_hidden(self, chunk_size=None, **kwargs):
+        return await sync_to_async(self.archive_hidden)(chunk_size=chunk_size, **kwargs)
+    aarchive_hidden.alters_data = True
     
+    @instrumented(writes=True)
     def get_or_create(self, defaults=None, **kwargs):
         # Overridden from parent class to avoid skipping 'deleted' objects.
         #
@@ -88,32 +731,669 @@ class HideableModelManager(models.Manager):
         # been included, it raises a HiddenObjectError instead to prevent 
         # giving users/apps accidental access to objects for which they might 
         #not have permission.
+        #
+        # The existing object is looked up with a single SELECT, so a hit is
+        # one query. On a miss, when the lookup matches a unique constraint
+        # exactly, the object is inserted with INSERT ... ON CONFLICT DO
+        # NOTHING (see _upsert) instead of an INSERT that can fail with an
+        # IntegrityError when another writer got there first. For a
+        # constraint from 'visible_unique' hidden objects are ignored, since
+        # a visible object can be created next to them.
         
-        include_hidden = bool(self.hidden_field_name in kwargs or
-                              (defaults and self.hidden_field_name in defaults))
+        include_hidden = self._includes_hidden(defaults, kwargs)
+        using = self._db or router.db_for_write(self.model, **self._hints)
         
+        target = self._unique_target(defaults, kwargs)
+        visible_only = bool(target and target[1])
         try:
-            obj = self.get(include_hidden=True, **kwargs)
+            obj, created = self.db_manager(using).get(include_hidden=not visible_only,
+                                                      **kwargs), False
+        except self.model.DoesNotExist:
+            if target and self._can_upsert(using):
+                obj, created = self._upsert(using, target[0], target[1], defaults, kwargs)
+            else:
+                obj, created = self._create(using, defaults, kwargs, visible_only)
+        
+        if not created and not include_hidden and getattr(obj, self.hidden_field_name):
+            raise HiddenObjectError('Object exists but is hidden. Lookup: %s'
+                                    % kwargs)
+        return obj, created
+    get_or_create.alters_data = True
+    
+    async def aget_or_create(self, defaults=None, **kwargs):
+        """
+        Async version of 'get_or_create', including the HiddenObjectError check
+        (QuerySet.aget_or_create would skip it).
+        """
+        return await sync_to_async(self.get_or_create)(defaults=defaults, **kwargs)
+    aget_or_create.alters_data = True
+    
+    def bulk_get_or_create(self, lookups, defaults=None, batch_size=1000):
+        """
+        Bulk version of 'get_or_create' for ingesting large numbers of objects.
+        'lookups' is an iterable of dicts of exact field lookups, which must all
+        use the same fields. Returns an iterator of (lookup, obj, status)
+        tuples in input order, where status is BULK_CREATED, BULK_EXISTING or
+        BULK_HIDDEN.
+        
+        Each batch of 'batch_size' lookups is resolved with one SELECT
+        covering visible and hidden objects, and the missing objects are
+        inserted with 'bulk_create' (so no save signals are sent), using
+        'defaults' as in 'get_or_create'. Lookups that match a hidden object,
+        which would raise HiddenObjectError in 'get_or_create', are reported
+        as BULK_HIDDEN with that object instead, unless 'get_or_create' would
+        return it (the hidden field is a lookup field or in 'defaults', or the
+        model includes hidden objects by default). Lookups are read and results produced one
+        batch at a time, so memory use doesn't depend on the input size.
+        """
+        lookups = iter(lookups)
+        using = self._db or router.db_for_write(self.model, **self._hints)
+        while True:
+            batch = list(itertools.islice(lookups, batch_size))
+            if not batch:
+                return
+            for result in self._bulk_get_or_create(using, batch, defaults):
+                yield result
+    bulk_get_or_create.alters_data = True
+    
+    def _bulk_fields(self, lookup):
+        fields = []
+        for name in sorted(lookup):
+            try:
+                fields.append(self.model._meta.get_field(name))
+            except FieldDoesNotExist:
+                raise FieldDoesNotExist("bulk_get_or_create only supports exact lookups "
+                                        "on concrete fields, not '%s'" % name)
+        return fields
+    
+    def _bulk_key(self, fields, values):
+        # normalizes lookup values and database values (e.g. model instances
+        # and primary keys for foreign keys) so they can be compared
+        key = []
+        for field, value in zip(fields, values):
+            if field.is_relation:
+                if isinstance(value, models.Model):
+                    value = value.pk
+                field = field.target_field
+            key.append(field.to_python(value))
+        return tuple(key)
+    
+    def _bulk_get_or_create(self, using, batch, defaults):
+        fields = self._bulk_fields(batch[0])
+        names = sorted(batch[0])
+        if any(sorted(lookup) != names for lookup in batch):
+            raise ValueError("All lookups passed to bulk_get_or_create must use the "
+                             "same fields")
+        keys = [self._bulk_key(fields, [lookup[name] for name in names])
+                for lookup in batch]
+        
+        target = self._unique_target(defaults, batch[0])
+        visible_only = bool(target and target[1])
+        existing = {}
+        queryset = self.db_manager(using).filter(include_hidden=not visible_only)
+        if len(fields) == 1:
+            queryset = queryset.filter(**{'%s__in' % names[0]: set(k[0] for k in keys)})
+        else:
+            queryset = queryset.filter(functools.reduce(operator.or_, [
+                models.Q(**lookup) for lookup in batch]))
+        for obj in queryset:
+            key = self._bulk_key(fields, [getattr(obj, field.attname) for field in fields])
+            if key in existing:
+                raise self.model.MultipleObjectsReturned(
+                    "bulk_get_or_create found more than one %s for lookup %s"
+                    % (self.model._meta.object_name, dict(zip(names, key))))
+            existing[key] = obj
+        
+        created = {}
+        for key, lookup in zip(keys, batch):
+            if key not in existing and key not in created:
+                created[key] = (lookup, self.model(**self._create_params(defaults, lookup)))
+        if created:
+            try:
+                with transaction.atomic(using=using):
+                    self.db_manager(using).bulk_create([obj for lookup, obj in
+                                                        created.values()])
+            except IntegrityError:
+                # another writer inserted some of the objects first; fall back
+                # to resolving them one lookup at a time
+                for key, (lookup, obj) in list(created.items()):
+                    obj, was_created = self._get_or_create(using, defaults, lookup,
+                                                           visible_only)
+                    if was_created:
+                        created[key] = (lookup, obj)
+                    else:
+                        existing[key] = obj
+                        del created[key]
+        
+        include_hidden = self._includes_hidden(defaults, batch[0])
+        for key, lookup in zip(keys, batch):
+            if key in created:
+                obj = existing[key] = created.pop(key)[1]
+                yield lookup, obj, BULK_CREATED
+                continue
+            obj = existing[key]
             if not include_hidden and getattr(obj, self.hidden_field_name):
-                raise HiddenObjectError('Object exists but is hidden. Lookup: %s'
-                                        % kwargs)
-            return obj, False
+                yield lookup, obj, BULK_HIDDEN
+            else:
+                yield lookup, obj, BULK_EXISTING
+    
+    def _includes_hidden(self, defaults, kwargs):
+        # whether get_or_create may return a hidden object: the hidden field
+        # is in the lookup or the defaults, or the model includes hidden
+        # objects by default
+        options = hideable_options(self.model)
+        return bool(self.hidden_field_name in kwargs or
+                    (defaults and self.hidden_field_name in defaults) or
+                    (options is not None and options.include_hidden))
+    
+    def _create_params(self, defaults, kwargs):
+        params = self.get_queryset()._extract_model_params(defaults, **kwargs)
+        return dict((key, value() if callable(value) else value)
+                    for key, value in params.items())
+    
+    def _get_or_create(self, using, defaults, kwargs, visible_only=False):
+        # Savepoint-based get_or_create, without the upsert. Unlike the parent
+        # implementation, the include_hidden lookup is the only SELECT issued
+        # unless the INSERT loses a race to another writer. Hidden objects are
+        # skipped for lookups on a 'visible_unique' constraint, since they
+        # don't conflict with the new object.
+        try:
+            return self.db_manager(using).get(include_hidden=not visible_only,
+                                              **kwargs), False
         except self.model.DoesNotExist:
-            return super(HideableModelManager, self).get_or_create(defaults=defaults or {}, 
-                                                                   **kwargs)
+            return self._create(using, defaults, kwargs, visible_only)
+    
+    def _create(self, using, defaults, kwargs, visible_only):
+        # The create half of _get_or_create, for lookups that found nothing
+        manager = self.db_manager(using)
+        params = self._create_params(defaults, kwargs)
+        try:
+            with transaction.atomic(using=using):
+                return manager.create(**params), True
+        except IntegrityError:
+            try:
+                return manager.get(include_hidden=not visible_only, **kwargs), False
+            except self.model.DoesNotExist:
+                pass
+            raise
+    
+    def _unique_target(self, defaults, kwargs):
+        # Returns (fields, condition) for a unique constraint matching the
+        # lookup params exactly, or None. The condition is the constraint for
+        # those generated from 'visible_unique', which only conflict with
+        # visible rows, so only visible objects are looked up and the new
+        # object must be visible too.
+        opts = self.model._meta
+        if not kwargs or self.hidden_field_name in kwargs:
+            return None
+        
+        lookup_fields = set()
+        for name in kwargs:
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.many_to_many:
+                return None
+            lookup_fields.add(field)
+        
+        for fields in self._unique_field_sets():
+            if set(fields) == lookup_fields:
+                return fields, None
+        if not (defaults and self.hidden_field_name in defaults):
+            for fields, constraint in self._visible_unique_field_sets():
+                if set(fields) == lookup_fields:
+                    return fields, constraint
+        return None
+    
+    def _can_upsert(self, using):
+        # An upsert skips Model.save() and pre_save, so models that customize
+        # either always use the regular path
+        connection = connections[using]
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            return False
+        features = connection.features
+        if not (getattr(features, 'supports_update_conflicts_with_target', False) and
+                features.can_return_columns_from_insert):
+            return False
+        return not (self.model._meta.parents or self.model.save is not models.Model.save or
+                    signals.pre_save.has_listeners(self.model))
+    
+    def _unique_field_sets(self):
+        opts = self.model._meta
+        for field in opts.local_concrete_fields:
+            if field.unique:
+                yield (field,)
+        for names in opts.unique_together:
+            yield tuple(opts.get_field(name) for name in names)
+        for constraint in opts.total_unique_constraints:
+            yield tuple(opts.get_field(name) for name in constraint.fields)
+    
+    def _visible_unique_field_sets(self):
+        opts = self.model._meta
+        condition = models.Q(**{self.hidden_field_name: False})
+        for constraint in opts.constraints:
+            if (isinstance(constraint, models.UniqueConstraint) and constraint.fields and
+                    constraint.condition == condition and not constraint.expressions and
+                    not constraint.include and not constraint.opclasses):
+                yield tuple(opts.get_field(name) for name in constraint.fields), constraint
+    
+    def _upsert(self, using, target, constraint, defaults, kwargs):
+        # Creates the object for a lookup that found nothing. INSERT ... ON
+        # CONFLICT DO NOTHING RETURNING yields the new row, or nothing if
+        # another writer inserted it since the SELECT, in which case that row
+        # is fetched with a second query. get_or_create SELECTs before the
+        # upsert, rather than upserting straight away, so that a hit is a
+        # single read: DO NOTHING returns no row on a hit and would need the
+        # SELECT anyway, and a no-op DO UPDATE would return the row in one
+        # statement but write and lock it on every hit. On PostgreSQL either
+        # form also uses up a sequence value per hit. A miss therefore costs
+        # the SELECT plus the INSERT. If the conflicting row is gone again by
+        # the time of the second SELECT, the regular path takes over.
+        connection = connections[using]
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        
+        obj = self.model(**self._create_params(defaults, kwargs))
+        pk_val = obj._get_pk_val(opts)
+        if pk_val is None:
+            pk_val = opts.pk.get_pk_value_on_save(obj)
+            obj._set_pk_val(pk_val)
+        fields = [field for field in opts.local_concrete_fields
+                  if not getattr(field, 'generated', False)]
+        if pk_val is None:
+            fields = [field for field in fields if field is not opts.auto_field]
+        
+        # the INSERT is checked for NOT NULL violations before conflicts, so
+        # a lookup without values for required fields can't be an upsert
+        if any(getattr(obj, field.attname) is None and not field.null and
+               not field.primary_key for field in fields):
+            return self._create(using, defaults, kwargs, constraint is not None)
+        
+        query = sql.InsertQuery(self.model)
+        query.insert_values(fields, [obj])
+        insert_sql, params = query.get_compiler(using=using).as_sql()[0]
+        
+        table = qn(opts.db_table)
+        returning = [field for field in opts.concrete_fields
+                     if not getattr(field, 'generated', False)]
+        returning_sql = ', '.join('%s.%s' % (table, qn(field.column))
+                                  for field in returning)
+        conflict_sql = ', '.join(qn(field.column) for field in target)
+        if constraint is not None:
+            # the predicate has to match the partial index's for the database
+            # to infer it, so it is rendered the same way
+            editor = connection.SchemaEditorClass(connection)
+            conflict_sql = '%s) WHERE (%s' % (conflict_sql, 
+                                              constraint._get_condition_sql(self.model, editor))
+        upsert_sql = ('%s ON CONFLICT (%s) DO NOTHING RETURNING %s'
+                      % (insert_sql, conflict_sql, returning_sql))
+        
+        # ON CONFLICT only covers the target constraint, so like the INSERT
+        # of _get_or_create this runs in a savepoint: a violation of any other
+        # constraint must not leave the caller's transaction aborted
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute(upsert_sql, params)
+                row = cursor.fetchone()
+        
+        if row is None:
+            try:
+                return self.db_manager(using).get(include_hidden=constraint is None,
+                                                  **kwargs), False
+            except self.model.DoesNotExist:
+                return self._create(using, defaults, kwargs, constraint is not None)
+        
+        obj = self._from_db_row(connection, using, returning, row)
+        signals.post_save.send(sender=self.model, instance=obj, created=True,
+                               update_fields=None, raw=False, using=using)
+        return obj, True
+    
+    def _from_db_row(self, connection, using, fields, row):
+        # Applies the same value conversions a regular SELECT would
+        values = []
+        for field, value in zip(fields, row):
+            col = field.get_col(self.model._meta.db_table)
+            converters = (connection.ops.get_db_converters(col) +
+                          col.get_db_converters(connection))
+            for converter in converters:
+                value = converter(value, col, connection)
+            values.append(value)
+        return self.model.from_db(using, [field.attname for field in fields], values)
 
 
 class AbstractHideableModel(models.Model):
     """
     Abstract Django model that provides support for using the 'deleted' field
     to hide objects instead of deleting them.
+    
+    Concrete subclasses automatically get a partial index on the primary key
+    restricted to visible rows (WHERE deleted = false). Additional visible-only
+    indexes can be requested by setting 'visible_indexes' to a sequence of
+    field names (or tuples of field names for composite indexes), e.g.:
+    
+        visible_indexes = ('name', ('owner', 'created'))
+    
+    Set 'visible_pk_index' to False to skip the automatic primary key index
+    (the MODEL_NINJA_VISIBLE_PK_INDEX setting changes the default for every
+    model). 'include_hidden_by_default' (or MODEL_NINJA_INCLUDE_HIDDEN) makes
+    the manager's querysets include hidden objects unless told otherwise.
+    These options are resolved once, when the model class is prepared, and
+    cached as '_meta.hideable' (see model_ninja.db.options).
+    
+    Hiding an object with 'hide' (or a queryset with hide(cascade=True)) also
+    hides the dependents declared in 'hide_relations', a dict mapping reverse
+    relation or many-to-many names to HIDE_CASCADE, HIDE_PROTECT or 
+    HIDE_IGNORE, e.g.:
+    
+        hide_relations = {'books': HIDE_CASCADE, 'orders': HIDE_PROTECT}
+    
+    Setting 'archive_mode' keeps hidden objects out of the main table: an
+    archive model with the same columns is generated (as 'archive_model', in
+    the table '<table>_hidden'), and hidden rows are moved there either when 
+    they are hidden (ARCHIVE_ON_HIDE) or when 'objects.archive_hidden()' is
+    run (ARCHIVE_ON_SWEEP). Queries with include_hidden=True read both tables,
+    and unhiding moves rows back. Saving an archived object updates its row
+    in the archive, or moves it back if it is no longer hidden. Writes such
+    as update() only see the main table, and since archiving deletes the row
+    from the main table, models that other models refer to (or that have
+    many-to-many fields) can't use archive mode; the system checks report
+    them (model_ninja.E001).
+    
+    'visible_unique' declares fields (or tuples of fields) that must be unique
+    among visible objects only, as UniqueConstraints WHERE deleted = false:
+    
+        visible_unique = ('email', ('owner', 'slug'))
+    
+    'get_or_create' on exactly those fields ignores hidden objects and, where
+    the database supports it, creates missing objects with an INSERT ... ON
+    CONFLICT against the constraint. The database constraint is what enforces them: model
+    validation (full_clean) only runs Django's usual SELECT for a
+    conditional UniqueConstraint, which a concurrent write can get past,
+    and the INSERT or UPDATE then fails with IntegrityError.
+    
+    Setting 'maintain_counts' keeps the numbers of visible and hidden objects
+    in the Django cache ('counts_cache', the default cache if not set), for
+    'objects.counts()' and model_ninja.db.counts.CountedPaginator. Set
+    'count_by' to a field name to also count per value of that field. Saves,
+    deletes, creates and the hide/unhide/purge methods update the counters
+    when their transaction commits. Writes with an unknown effect, such as
+    update(), drop the counters so they are counted again when next read, and
+    the 'reconcile_counts' management command corrects any drift. Deletes
+    are counted by a post_delete receiver, which turns off Django's fast
+    delete: delete() and purge_hidden() load the objects they remove to
+    send post_delete, instead of running a single DELETE.
+    
+    Setting 'cache_objects' allows 'objects.get_cached()' and
+    'in_bulk_cached()' and connects the receivers that invalidate the cached
+    objects on every write, in every process, whether it reads through the
+    cache or not (see model_ninja.db.cache.ObjectCache). Like
+    'maintain_counts', it turns off fast deletes.
+    
+    Setting 'visible_view' makes queries for visible objects read from a
+    database view of the visible rows ('<table>_visible', or the name given
+    as 'visible_view') instead of filtering the table, so raw SQL and other
+    readers of the database can share the same filtering. The view is
+    created by the CreateVisibleView migration operation, which has to be
+    run again after columns are added or removed (see
+    model_ninja.db.operations). Writes and queries with include_hidden=True
+    use the table.
+    
+    Setting 'outbox' records every batch of objects hidden or unhidden, by
+    any of the hide/unhide methods, in an outbox model ('outbox_model', in
+    the table '<table>_changes') within the same transaction. Downstream
+    caches and indexes read the records in batches with
+    model_ninja.db.outbox.ChangeFeed. Writes that bypass these methods, such
+    as update(deleted=True), are not recorded.
     """
     deleted = models.BooleanField(default=False)
     objects = HideableModelManager()
     
+    visible_pk_index = None
+    include_hidden_by_default = None
+    visible_indexes = ()
+    visible_unique = ()
+    hide_relations = {}
+    archive_mode = None
+    maintain_counts = False
+    count_by = None
+    cache_objects = False
+    visible_view = False
+    outbox = False
+    
     class Meta:
         abstract = True
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Saving an object whose row was archived would otherwise find no row
+        # in the main table and INSERT a second copy of it there
+        updated = super(AbstractHideableModel, self)._do_update(
+                      base_qs, using, pk_val, values, update_fields, forced_update)
+        if not updated and getattr(type(self), 'archive_model', None) is not None:
+            hidden = getattr(self, self._meta.hideable.hidden_field_name)
+            updated = update_archived(type(self), pk_val, values, using, hidden=hidden)
+        return updated
+    
+    def _set_hidden(self, hidden, using):
+        using = using or self._state.db or router.db_for_write(type(self), instance=self)
+        timestamp = timezone.now()
+        collector = HideCollector(using, hidden=hidden, timestamp=timestamp)
+        collector.collect(type(self), [self.pk])
+        collector.execute()
+        for name, value in hidden_values(type(self), hidden, timestamp).items():
+            setattr(self, name, value)
+        counts.track(self)
+    
+    def hide(self, using=None):
+        """
+        Hides this object and, following 'hide_relations', its dependents in
+        a single transaction. Raises HideProtectedError if a protected 
+        relation still has visible objects.
+        """
+        self._set_hidden(True, using)
+    hide.alters_data = True
+    
+    def unhide(self, using=None):
+        """
+        Restores this object and its hidden dependents, following the
+        HIDE_CASCADE relations in 'hide_relations'.
+        """
+        self._set_hidden(False, using)
+    unhide.alters_data = True
+    
+    async def ahide(self, using=None):
+        return await sync_to_async(self.hide)(using=using)
+    ahide.alters_data = True
+    
+    async def aunhide(self, using=None):
+        return await sync_to_async(self.unhide)(using=using)
+    aunhide.alters_data = True
+
+
+class TimestampedHideableModelManager(HideableModelManager):
+    """
+    HideableModelManager for models with a 'hidden_at' timestamp, such as
+    subclasses of AbstractTimestampedHideableModel.
+    """
+    hidden_at_field_name = "hidden_at"
+
+
+class AbstractTimestampedHideableModel(AbstractHideableModel):
+    """
+    AbstractHideableModel that also records when an object was hidden. The
+    'hidden_at' field is set by the manager/queryset 'hide' methods and by
+    'hide' on the instance, cleared when the object is restored, and gets a
+    partial index over hidden rows for retention jobs such as the 
+    'sweep_hidden' management command.
+    """
+    hidden_at = models.DateTimeField(null=True, blank=True, editable=False)
+    objects = TimestampedHideableModelManager()
+    
+    class Meta:
+        abstract = True
+
+
+# statuses reported by HideableModelManager.bulk_get_or_create
+BULK_CREATED = 'created'
+BULK_EXISTING = 'existing'
+BULK_HIDDEN = 'hidden'
 
 
 class HiddenObjectError(IntegrityError):
-    pass
\ No newline at end of file
+    pass
+
+
+def _partial_index(model, fields, condition, suffix):
+    index = models.Index(fields=list(fields))
+    index.suffix = suffix
+    index.set_name_with_model(model)
+    index.condition = condition
+    return index
+
+
+def visible_index(model, fields, hidden_field_name):
+    """
+    Returns a models.Index over 'fields' of 'model' that only covers rows where
+    the hidden field is False. The index name is generated the same way Django
+    names unnamed indexes, using the 'vis' suffix.
+    """
+    return _partial_index(model, fields, models.Q(**{hidden_field_name: False}), 'vis')
+
+
+def hidden_at_index(model, hidden_at_field_name, hidden_field_name):
+    """
+    Returns a models.Index on the hidden timestamp of 'model' that only covers
+    hidden rows, for the range scans done by retention jobs ('hid' suffix).
+    """
+    return _partial_index(model, [hidden_at_field_name],
+                          models.Q(**{hidden_field_name: True}), 'hid')
+
+
+def visible_unique_constraint(model, fields, hidden_field_name):
+    """
+    Returns a models.UniqueConstraint over 'fields' of 'model' that only
+    applies to rows where the hidden field is False, so hidden objects don't
+    block visible ones with the same values. Named like visible_index, with
+    the 'vuq' suffix. Validation of the constraint is left to Django's
+    validate_constraints().
+    """
+    name = _partial_index(model, fields, None, 'vuq').name
+    return models.UniqueConstraint(fields=list(fields), name=name,
+                                   condition=models.Q(**{hidden_field_name: False}))
+
+
+def _resolve_options(sender, **kwargs):
+    # Resolves the hidden field configuration of models whose default
+    # manager is a HideableModelManager, once, for the handlers below and
+    # for the managers and querysets. Connected first, so it runs first
+    opts = sender._meta
+    if not isinstance(opts.default_manager, HideableModelManager):
+        opts.hideable = None
+        return
+    options = opts.hideable = HideableOptions(sender, opts.default_manager)
+    # The visible view is built on the model's own table, so the hidden
+    # field must be one of its columns. Multi-table children don't inherit
+    # the view
+    if options.visible_view and not options.local:
+        if 'visible_view' in sender.__dict__:
+            raise ImproperlyConfigured("%s can't use a visible view, since its hidden "
+                                       "field is not on its own table" % opts.object_name)
+        options.visible_view = None
+
+signals.class_prepared.connect(_resolve_options)
+
+
+def _add_indexes(sender, **kwargs):
+    # Contributes the partial indexes and visible-only unique constraints to
+    # concrete models that use a HideableModelManager. The hidden field must
+    # live on the model's own table, so proxies and multi-table children of
+    # hideable models are skipped
+    opts = sender._meta
+    options = opts.hideable
+    if opts.proxy or options is None or not options.local:
+        return
+    
+    hidden_field_name = options.hidden_field_name
+    field_sets = list(options.visible_indexes)
+    if options.visible_pk_index:
+        field_sets.insert(0, (opts.pk.name,))
+    
+    indexes = [visible_index(sender, fields, hidden_field_name) for fields in field_sets]
+    if options.hidden_at_field_name in [field.name for field in opts.local_fields]:
+        indexes.append(hidden_at_index(sender, options.hidden_at_field_name, 
+                                       hidden_field_name))
+    
+    existing = set(index.name for index in opts.indexes)
+    for index in indexes:
+        if index.name not in existing:
+            opts.indexes.append(index)
+            existing.add(index.name)
+    
+    existing = set(constraint.name for constraint in opts.constraints)
+    for fields in options.visible_unique:
+        constraint = visible_unique_constraint(sender, fields, hidden_field_name)
+        if constraint.name not in existing:
+            opts.constraints.append(constraint)
+            existing.add(constraint.name)
+    
+    # migration state is built from the options declared in Meta, so the
+    # contributed indexes need to be recorded there for makemigrations
+    opts.original_attrs['indexes'] = opts.indexes
+    if opts.constraints:
+        opts.original_attrs['constraints'] = opts.constraints
+
+signals.class_prepared.connect(_add_indexes)
+
+
+def _add_archive_model(sender, **kwargs):
+    # Generates the archive model for hideable models with an 'archive_mode'
+    opts = sender._meta
+    if opts.proxy or opts.hideable is None or not getattr(sender, 'archive_mode', None):
+        return
+    if not issubclass(sender, AbstractHideableModel):
+        raise ImproperlyConfigured("%s can't use archive_mode, since it doesn't extend "
+                                   "AbstractHideableModel" % opts.object_name)
+    if sender.archive_mode not in (ARCHIVE_ON_HIDE, ARCHIVE_ON_SWEEP):
+        raise ImproperlyConfigured("Unknown archive_mode %r on %s" 
+                                   % (sender.archive_mode, opts.object_name))
+    sender.archive_model = make_archive_model(sender)
+
+signals.class_prepared.connect(_add_archive_model)
+
+
+def _add_outbox_model(sender, **kwargs):
+    # Generates the outbox model for hideable models with 'outbox' set
+    opts = sender._meta
+    if opts.proxy or opts.hideable is None or not getattr(sender, 'outbox', False):
+        return
+    sender.outbox_model = outbox.make_outbox_model(sender)
+    outbox.connect(sender)
+
+signals.class_prepared.connect(_add_outbox_model)
+
+
+def _connect_counts(sender, **kwargs):
+    # Connects the receivers that maintain the counters of hideable models
+    # with 'maintain_counts'
+    opts = sender._meta
+    if opts.proxy or opts.hideable is None or not getattr(sender, 'maintain_counts', False):
+        return
+    if sender.count_by:
+        try:
+            opts.get_field(sender.count_by)
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured("count_by on %s names the unknown field '%s'"
+                                       % (opts.object_name, sender.count_by))
+    counts.connect(sender)
+
+signals.class_prepared.connect(_connect_counts)
+
+
+def _connect_cache(sender, **kwargs):
+    # Connects the receivers that invalidate the cached objects of hideable
+    # models with 'cache_objects'
+    if sender._meta.hideable is not None and getattr(sender, 'cache_objects', False):
+        connect_cache(sender)
+
+signals.class_prepared.connect(_connect_cache)
+
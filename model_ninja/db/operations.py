@@ -0,0 +1,197 @@
+from django.db.migrations.operations import AddIndex, RemoveIndex
+from django.db.migrations.operations.base import Operation
+
+from model_ninja.db.views import create_visible_view, drop_visible_view
+
+
+# model state option holding the (view_name, hidden_field) of the view
+# created by the last CreateVisibleView
+VIEW_OPTION = '_visible_view'
+
+
+def _concurrently(schema_editor):
+    # CREATE/DROP INDEX CONCURRENTLY is PostgreSQL-only and cannot run inside a
+    # transaction block, so it is only used for non-atomic migrations
+    connection = schema_editor.connection
+    return connection.vendor == 'postgresql' and not connection.in_atomic_block
+
+
+def _supported_index(schema_editor, index):
+    # Backends without partial index support get a plain index on the same
+    # columns rather than silently failing to create one at all
+    if index.condition is None or schema_editor.connection.features.supports_partial_indexes:
+        return index
+    index = index.clone()
+    index.condition = None
+    return index
+
+
+class AddVisibleIndex(AddIndex):
+    """
+    Migration operation for the visible-only partial indexes contributed by
+    hideable models. Use it in place of the AddIndex operation generated by
+    makemigrations.
+
+    On PostgreSQL the index is built with CREATE INDEX CONCURRENTLY when the
+    migration is not atomic (set 'atomic = False' on the Migration class), so
+    the table is not locked against writes while the index is built. Inside a
+    transaction, and on other databases such as SQLite, a regular CREATE INDEX
+    is used. Databases without partial index support get an index on the same
+    columns without the WHERE clause.
+    """
+    atomic = False
+
+    def describe(self):
+        return 'Create visible-only index %s on field(s) %s of model %s' % (
+            self.index.name, ', '.join(self.index.fields), self.model_name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = _supported_index(schema_editor, self.index)
+        if _concurrently(schema_editor):
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if _concurrently(schema_editor):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+
+class RemoveVisibleIndex(RemoveIndex):
+    """
+    Counterpart of AddVisibleIndex: drops a visible-only index, concurrently
+    on PostgreSQL when the migration is not atomic.
+    """
+    atomic = False
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = from_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+        if _concurrently(schema_editor):
+            schema_editor.remove_index(model, index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        index = to_state.models[app_label, self.model_name_lower].get_index_by_name(self.name)
+        index = _supported_index(schema_editor, index)
+        if _concurrently(schema_editor):
+            schema_editor.add_index(model, index, concurrently=True)
+        else:
+            schema_editor.add_index(model, index)
+
+
+class CreateVisibleView(Operation):
+    """
+    Migration operation that creates the database view of visible rows read
+    by hideable models with 'visible_view' set:
+
+        CreateVisibleView('book')
+
+    Pass 'hidden_field' for a custom hidden field and 'view_name' if the
+    model's 'visible_view' names the view. The view lists the table's
+    columns as of this migration, so add the operation again after adding
+    or removing fields (it replaces an existing view); on PostgreSQL, put a
+    RemoveVisibleView before operations that drop or alter columns the view
+    uses. Unapplying it recreates the view it replaced, as of the earlier
+    migration, and only drops the view if there was none.
+    """
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name, hidden_field='deleted', view_name=None):
+        self.model_name = model_name
+        self.hidden_field = hidden_field
+        self.view_name = view_name
+
+    def deconstruct(self):
+        kwargs = {'model_name': self.model_name}
+        if self.hidden_field != 'deleted':
+            kwargs['hidden_field'] = self.hidden_field
+        if self.view_name:
+            kwargs['view_name'] = self.view_name
+        return self.__class__.__name__, [], kwargs
+
+    def _model_state(self, app_label, state):
+        return state.models[app_label, self.model_name.lower()]
+
+    def state_forwards(self, app_label, state):
+        # The view isn't part of the model, but backwards operations need to
+        # know which view, if any, existed before. It is kept in the model
+        # state's options under a private key, which rendering ignores
+        options = self._model_state(app_label, state).options
+        options[VIEW_OPTION] = (self.view_name, self.hidden_field)
+
+    def _view_name(self, model, view_name=None):
+        return view_name or '%s_visible' % model._meta.db_table
+
+    def _create(self, app_label, schema_editor, state, view=None):
+        view_name, hidden_field = view or (self.view_name, self.hidden_field)
+        model = state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            create_visible_view(schema_editor, model, self._view_name(model, view_name),
+                                hidden_field)
+
+    def _drop(self, app_label, schema_editor, state, view=None):
+        view_name = view[0] if view else self.view_name
+        model = state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            drop_visible_view(schema_editor, model, self._view_name(model, view_name))
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._create(app_label, schema_editor, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        # restores the view this operation replaced, if there was one
+        self._drop(app_label, schema_editor, from_state)
+        previous = self._model_state(app_label, to_state).options.get(VIEW_OPTION)
+        if previous is not None:
+            self._create(app_label, schema_editor, to_state, previous)
+
+    def describe(self):
+        return 'Create visible view of model %s' % self.model_name
+
+    @property
+    def migration_name_fragment(self):
+        return '%s_visible_view' % self.model_name.lower()
+
+
+class RemoveVisibleView(CreateVisibleView):
+    """
+    Counterpart of CreateVisibleView: drops the visible view of a model.
+    """
+    def state_forwards(self, app_label, state):
+        self._model_state(app_label, state).options.pop(VIEW_OPTION, None)
+
+    def _view(self, app_label, state):
+        # the view as the last CreateVisibleView defined it, unless named here
+        view = self._model_state(app_label, state).options.get(VIEW_OPTION)
+        if self.view_name or view is None:
+            return self.view_name, self.hidden_field
+        return view
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._drop(app_label, schema_editor, from_state, self._view(app_label, from_state))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._create(app_label, schema_editor, to_state, self._view(app_label, to_state))
+
+    def describe(self):
+        return 'Remove visible view of model %s' % self.model_name
+
+    @property
+    def migration_name_fragment(self):
+        return 'remove_%s_visible_view' % self.model_name.lower()
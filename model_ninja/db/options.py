@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db.models.constants import LOOKUP_SEP
+
+
+def _field_sets(value):
+    return tuple((fields,) if isinstance(fields, str) else tuple(fields) for fields in value)
+
+
+class HideableOptions(object):
+    """
+    Hidden field configuration of a model with a HideableModelManager as its
+    default manager, resolved once when the model class is prepared and
+    cached as '_meta.hideable' (None for other models):
+
+    - 'hidden_field_name' and 'hidden_at_field_name', from the manager
+    - 'hidden_lookups', the filter keywords that select on the hidden field
+      and so turn off the implicit hidden filter
+    - 'local', True if the hidden field is on the model's own table
+    - 'include_hidden', whether the manager's querysets include hidden
+      objects unless told otherwise (the model's 'include_hidden_by_default',
+      or the MODEL_NINJA_INCLUDE_HIDDEN setting, default False)
+    - 'visible_pk_index' (the model attribute, or the
+      MODEL_NINJA_VISIBLE_PK_INDEX setting, default True), and
+      'visible_indexes' and 'visible_unique' as tuples of field name tuples
+    - 'visible_view', the name of the model's visible view or None
+
+    Settings are read when each model class is prepared, not on import.
+    """
+    def __init__(self, model, manager):
+        opts = model._meta
+        self.hidden_field_name = manager.hidden_field_name
+        self.hidden_at_field_name = manager.hidden_at_field_name
+        self.hidden_lookups = frozenset([self.hidden_field_name,
+                                         self.hidden_field_name + LOOKUP_SEP + 'exact'])
+        local_fields = opts.concrete_model._meta.local_fields
+        self.local = self.hidden_field_name in [field.name for field in local_fields]
+
+        include_hidden = getattr(model, 'include_hidden_by_default', None)
+        if include_hidden is None:
+            include_hidden = getattr(settings, 'MODEL_NINJA_INCLUDE_HIDDEN', False)
+        self.include_hidden = bool(include_hidden)
+
+        visible_pk_index = getattr(model, 'visible_pk_index', None)
+        if visible_pk_index is None:
+            visible_pk_index = getattr(settings, 'MODEL_NINJA_VISIBLE_PK_INDEX', True)
+        self.visible_pk_index = bool(visible_pk_index)
+        self.visible_indexes = _field_sets(getattr(model, 'visible_indexes', ()))
+        self.visible_unique = _field_sets(getattr(model, 'visible_unique', ()))
+
+        view = getattr(model, 'visible_view', None)
+        if not view:
+            self.visible_view = None
+        elif isinstance(view, str):
+            self.visible_view = view
+        else:
+            self.visible_view = '%s_visible' % opts.db_table
+
+    def __repr__(self):
+        return '<HideableOptions: %s>' % self.hidden_field_name
+
+
+def hideable_options(model):
+    """
+    Returns the HideableOptions of a model, or None if it isn't hideable.
+    """
+    return getattr(model._meta, 'hideable', None)
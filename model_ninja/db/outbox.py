@@ -0,0 +1,118 @@
+import collections
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, router, transaction
+from django.utils import timezone
+
+from model_ninja.db.signals import post_hide
+
+
+Change = collections.namedtuple('Change', ['id', 'pks', 'hidden', 'created'])
+
+
+def make_outbox_model(model):
+    """
+    Creates the outbox model for a hideable model with 'outbox' set: a model
+    in the same app, stored in '<table>_changes', with one row per batch of
+    objects hidden or unhidden. The primary keys of the batch are stored as
+    a JSON list.
+    """
+    opts = model._meta
+
+    class Meta:
+        app_label = opts.app_label
+        apps = opts.apps
+        db_table = '%s_changes' % opts.db_table
+        managed = opts.managed
+
+    attrs = {'__module__': model.__module__,
+             '__doc__': 'Hide and unhide changes of %s.' % opts.object_name,
+             'id': models.BigAutoField(primary_key=True),
+             'pks': models.JSONField(encoder=DjangoJSONEncoder),
+             'hidden': models.BooleanField(),
+             'created': models.DateTimeField(default=timezone.now),
+             'Meta': Meta}
+    return type('%sChange' % opts.object_name, (models.Model,), attrs)
+
+
+def _record(sender, pks, hidden, count, using, **kwargs):
+    # Sent inside the transaction of the hide or unhide, so the record is
+    # committed or rolled back with it
+    if count and pks is not None:
+        sender.outbox_model._base_manager.using(using).create(pks=list(pks), hidden=hidden)
+
+
+def connect(model):
+    """
+    Connects the receiver that writes the outbox records of 'model'. Done
+    for every model with 'outbox' set when the model class is prepared.
+    """
+    post_hide.connect(_record, sender=model, weak=False, dispatch_uid='model_ninja_outbox')
+
+
+class ChangeFeed(object):
+    """
+    Consumer of the outbox of a hideable model, e.g.:
+
+        feed = ChangeFeed(Book)
+        feed.consume(lambda changes: index.refresh(pk for change in changes
+                                                   for pk in change.pks))
+
+    'fetch' returns the oldest Change records (id, pks, hidden, created)
+    and 'ack' deletes them once they are handled, so records are delivered
+    at least once. 'consume' does both in a transaction per batch; on
+    databases that support SKIP LOCKED, several consumers can run at once
+    without getting the same records.
+    """
+    def __init__(self, model, using=None):
+        if getattr(model, 'outbox_model', None) is None:
+            raise ImproperlyConfigured("%s has no outbox; set 'outbox' on the model"
+                                       % model._meta.object_name)
+        self.model = model.outbox_model
+        self.using = using or router.db_for_write(self.model)
+
+    def _records(self):
+        return self.model._base_manager.using(self.using).order_by('pk')
+
+    def fetch(self, limit=1000):
+        """
+        Returns a list of up to 'limit' unacknowledged Change records, oldest
+        first.
+        """
+        records = self._records()
+        connection = connections[self.using]
+        if (connection.in_atomic_block and
+                connection.features.has_select_for_update_skip_locked):
+            # locked until the transaction ends, e.g. inside 'consume'
+            records = records.select_for_update(skip_locked=True)
+        return [Change(*values) for values in
+                records.values_list('pk', 'pks', 'hidden', 'created')[:limit]]
+
+    def ack(self, changes):
+        """
+        Deletes the given Change records (or record ids) from the outbox.
+        Returns the number of records deleted.
+        """
+        ids = [getattr(change, 'id', change) for change in changes]
+        if not ids:
+            return 0
+        return self._records().filter(pk__in=ids).delete()[0]
+
+    def consume(self, handler, limit=1000, max_batches=None):
+        """
+        Calls 'handler' with each batch of up to 'limit' Change records and
+        acknowledges the batch when it returns, until the outbox is empty or
+        'max_batches' batches were handled. A batch whose handler raises is
+        left in the outbox. Returns the number of records handled.
+        """
+        count = batches = 0
+        while max_batches is None or batches < max_batches:
+            with transaction.atomic(using=self.using):
+                changes = self.fetch(limit)
+                if not changes:
+                    break
+                handler(changes)
+                count += self.ack(changes)
+            batches += 1
+        return count
@@ -0,0 +1,23 @@
+from django.dispatch import Signal
+
+
+# Sent after objects of a hideable model are hidden or unhidden, with the
+# model as sender and the arguments 'pks' (the primary keys of the objects
+# that were checked, or None if the operation didn't load them), 'hidden',
+# 'count' (the number of objects changed) and 'using'.
+post_hide = Signal()
+
+# Sent after HideableQuerySet.purge_hidden deletes hidden objects, with the
+# arguments 'pks' (or None, as for post_hide), 'count' and 'using'.
+post_purge = Signal()
+
+# Sent after HideableQuerySet.bulk_create inserts objects, with the arguments
+# 'objs' and 'using'. Inserts that may have skipped or updated conflicting
+# rows send post_bulk_write instead.
+post_bulk_create = Signal()
+
+# Sent after other set-based writes to a hideable model that don't send the
+# save or delete signals: HideableQuerySet.update and bulk_update, and
+# bulk_create with 'ignore_conflicts' or 'update_conflicts'. Has the
+# arguments 'pks' (or None, as for post_hide) and 'using'.
+post_bulk_write = Signal()
@@ -0,0 +1,45 @@
+from django.db import connections
+from django.utils import timezone
+
+from model_ninja.db.options import hideable_options
+
+
+def hidden_field_name(model):
+    """
+    Returns the name of the hidden field of a model managed by a
+    HideableModelManager, or None for any other model.
+    """
+    options = hideable_options(model)
+    return options.hidden_field_name if options is not None else None
+
+
+def hidden_at_field_name(model):
+    """
+    Returns the name of the field recording when objects of a hideable model
+    were hidden, or None if the model doesn't have one.
+    """
+    options = hideable_options(model)
+    return options.hidden_at_field_name if options is not None else None
+
+
+def hidden_values(model, hidden, timestamp=None):
+    """
+    Returns the field values that hide (or unhide) an object of 'model': the
+    hidden field, and the hidden timestamp if the model has one.
+    """
+    values = {hidden_field_name(model): hidden}
+    name = hidden_at_field_name(model)
+    if name:
+        values[name] = (timestamp or timezone.now()) if hidden else None
+    return values
+
+
+def pk_batches(pks, using):
+    """
+    Splits a collection of primary keys into lists small enough to be used in
+    a single 'pk__in' lookup on the given database.
+    """
+    pks = list(pks)
+    size = connections[using].ops.bulk_batch_size(['pk'], pks) or 1
+    for start in range(0, len(pks), size):
+        yield pks[start:start + size]
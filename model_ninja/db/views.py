@@ -0,0 +1,90 @@
+from django.db.models.sql.datastructures import BaseTable
+
+from model_ninja.db.options import hideable_options
+from model_ninja.db.utils import hidden_field_name
+
+
+def visible_view_name(model):
+    """
+    Returns the name of the database view of visible rows of a hideable model
+    with 'visible_view' set: '<table>_visible', or the name given as
+    'visible_view'. Returns None for other models.
+    """
+    options = hideable_options(model)
+    return options.visible_view if options is not None else None
+
+
+def visible_view_sql(schema_editor, model, hidden_field):
+    """
+    Returns the SELECT statement that defines the visible view of 'model'.
+    The columns are listed explicitly, so the view has to be created again
+    when columns are added to the table.
+    """
+    qn = schema_editor.connection.ops.quote_name
+    column = model._meta.get_field(hidden_field).column
+    return 'SELECT %s FROM %s WHERE %s = %s' % (
+        ', '.join(qn(field.column) for field in model._meta.concrete_fields),
+        qn(model._meta.db_table), qn(column), schema_editor.quote_value(False))
+
+
+def create_visible_view(schema_editor, model, view_name=None, hidden_field=None):
+    """
+    Creates, or replaces, the visible view of 'model'. The view name and
+    hidden field default to those of the model, which have to be passed for
+    the historical models used by migrations.
+    """
+    qn = schema_editor.connection.ops.quote_name
+    view_name = view_name or visible_view_name(model)
+    drop_visible_view(schema_editor, model, view_name)
+    schema_editor.execute('CREATE VIEW %s AS %s' % (
+        qn(view_name),
+        visible_view_sql(schema_editor, model, hidden_field or hidden_field_name(model))))
+
+
+def drop_visible_view(schema_editor, model, view_name=None):
+    """
+    Drops the visible view of 'model', if it exists.
+    """
+    qn = schema_editor.connection.ops.quote_name
+    schema_editor.execute('DROP VIEW IF EXISTS %s' % qn(view_name or visible_view_name(model)))
+
+
+class VisibleViewTable(BaseTable):
+    """
+    Base table of a query that only reads visible objects: the visible view
+    of the model, under the main table's alias so the rest of the query is
+    unchanged.
+    """
+    def __init__(self, table_name, alias, view_name):
+        super(VisibleViewTable, self).__init__(table_name, alias)
+        self.view_name = view_name
+
+    def as_sql(self, compiler, connection):
+        return '%s %s' % (connection.ops.quote_name(self.view_name),
+                          compiler.quote_name_unless_alias(self.table_alias)), []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(self.table_name,
+                              change_map.get(self.table_alias, self.table_alias),
+                              self.view_name)
+
+    @property
+    def identity(self):
+        return self.__class__, self.table_name, self.table_alias, self.view_name
+
+
+def read_from_view(query):
+    """
+    Makes 'query' read from the visible view of its model instead of adding
+    the hidden predicate. Returns False, leaving the query unchanged, if the
+    model has no view or the query filters on a different hidden field.
+    """
+    model = query.model
+    options = hideable_options(model)
+    if (options is None or options.visible_view is None or
+            query.hidden_field_name != options.hidden_field_name):
+        return False
+    alias = query.base_table if query.alias_map else query.get_initial_alias()
+    query.alias_map[alias] = VisibleViewTable(model._meta.db_table, alias,
+                                              options.visible_view)
+    return True
@@ -0,0 +1,44 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from model_ninja.db.counts import reconcile_counts
+
+
+class Command(BaseCommand):
+    help = ("Recounts the maintained visible and hidden counters of hideable models "
+            "with 'maintain_counts', correcting any drift. Meant to be run "
+            "periodically.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', metavar='app_label.ModelName',
+                            help='Models to reconcile (default: all models with '
+                                 'maintain_counts).')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to count (default: "default").')
+
+    def handle(self, *args, **options):
+        if options['models']:
+            models = []
+            for label in options['models']:
+                try:
+                    model = apps.get_model(label)
+                except (LookupError, ValueError) as e:
+                    raise CommandError(str(e))
+                if not getattr(model, 'maintain_counts', False):
+                    raise CommandError("%s doesn't maintain counts" % label)
+                models.append(model)
+        else:
+            models = [model for model in apps.get_models()
+                      if getattr(model, 'maintain_counts', False)]
+
+        for model in models:
+            old, new = reconcile_counts(model, using=options['database'])
+            if old is None:
+                change = 'not cached'
+            elif old == new:
+                change = 'unchanged'
+            else:
+                change = 'was %d visible, %d hidden' % old
+            self.stdout.write("%s: %d visible, %d hidden (%s)"
+                              % (model._meta.label, new.visible, new.hidden, change))
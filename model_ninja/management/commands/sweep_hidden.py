@@ -0,0 +1,109 @@
+import datetime
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from model_ninja.db.models import HideableModelManager
+
+
+class Command(BaseCommand):
+    help = ("Purges (or archives) hidden objects of hideable models in primary key "
+            "order, one batch and transaction at a time. Prints the last primary "
+            "key of every batch, so an interrupted sweep can be resumed with "
+            "--start-after.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='+', metavar='app_label.ModelName',
+                            help='Hideable models to sweep.')
+        parser.add_argument('--older-than', type=float, metavar='DAYS',
+                            help='Only sweep objects hidden more than DAYS days ago. '
+                                 'Requires a hidden timestamp field.')
+        parser.add_argument('--archive', action='store_true',
+                            help='Move hidden objects to the archive table instead '
+                                 'of deleting them.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of objects per batch (default: 1000).')
+        parser.add_argument('--sleep', type=float, default=0, metavar='SECONDS',
+                            help='Pause between batches to limit the load on the '
+                                 'database.')
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches per model.')
+        parser.add_argument('--start-after', metavar='PK',
+                            help='Resume after this primary key. Only valid when '
+                                 'sweeping a single model.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the number of objects to sweep.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database to sweep (default: "default").')
+
+    def handle(self, *args, **options):
+        labels = options['models']
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be a positive number")
+        if options['start_after'] is not None and len(labels) > 1:
+            raise CommandError("--start-after can only be used with a single model")
+        cutoff = None
+        if options['older_than'] is not None:
+            cutoff = timezone.now() - datetime.timedelta(days=options['older_than'])
+        
+        for model in [self._get_model(label, options) for label in labels]:
+            self._sweep(model, cutoff, options)
+
+    def _get_model(self, label, options):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        manager = model._default_manager
+        if not isinstance(manager, HideableModelManager):
+            raise CommandError("%s is not a hideable model" % label)
+        if options['older_than'] is not None and not manager.hidden_at_field_name:
+            raise CommandError("--older-than requires a hidden timestamp field, "
+                               "which %s doesn't have" % label)
+        if options['archive'] and getattr(model, 'archive_model', None) is None:
+            raise CommandError("%s doesn't have an archive table" % label)
+        return model
+
+    def _sweep(self, model, cutoff, options):
+        manager = model._default_manager.db_manager(options['database'])
+        lookup = {manager.hidden_field_name: True}
+        if cutoff is not None:
+            lookup['%s__lt' % manager.hidden_at_field_name] = cutoff
+        if options['archive']:
+            # archived objects are already swept, so only the main table is read
+            queryset = model._base_manager.db_manager(options['database']).filter(**lookup)
+        else:
+            queryset = manager.filter(include_hidden=True, **lookup)
+        label = model._meta.label
+        
+        if options['dry_run']:
+            self.stdout.write("%s: %d objects to sweep" % (label, queryset.count()))
+            return
+        
+        last_pk = options['start_after']
+        total = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            pending = queryset.order_by('pk')
+            if last_pk is not None:
+                pending = pending.filter(pk__gt=last_pk)
+            pks = list(pending.values_list('pk', flat=True)[:options['chunk_size']])
+            if not pks:
+                break
+            # the lookup is applied again to the batch, in the transaction
+            # that sweeps it, since its objects may have been unhidden and
+            # hidden again (with a new timestamp) since they were selected
+            with transaction.atomic(using=options['database']):
+                batch = manager.filter(pk__in=pks, **lookup)
+                if options['archive']:
+                    total += batch.archive_hidden()
+                else:
+                    total += batch.purge_hidden()
+            batches += 1
+            last_pk = pks[-1]
+            self.stdout.write("%s: swept %d objects, last pk %s" % (label, total, last_pk))
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write("%s: done, %d objects swept" % (label, total))
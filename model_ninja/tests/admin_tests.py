@@ -0,0 +1,136 @@
+import json
+from unittest import mock
+
+from django.contrib.admin import AdminSite
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase
+
+from model_ninja.admin import (EstimatedCountPaginator, HiddenListFilter, HideableModelAdmin,
+                               StaffHideableModelAdmin)
+from model_ninja.tests.models import (CountedHiddenModel, HiddenModel, HideableChildModel,
+                                      RelatedHiddenModel)
+
+
+class HideableModelAdminTests(TestCase):
+    def setUp(self):
+        self.site = AdminSite()
+        self.superuser = User.objects.create_superuser("admin", "admin@example.com", None)
+        self.staff = User.objects.create_user("staff", "staff@example.com", None,
+                                              is_staff=True)
+        self.hcm1 = HideableChildModel.objects.create(name="test-2210")
+        self.hcm2 = HideableChildModel.objects.create(name="test-2211", deleted=True)
+        self.hcm3 = HideableChildModel.objects.create(name="test-2212")
+
+    def _request(self, user, **params):
+        request = RequestFactory().get("/", params)
+        request.user = user
+        request._messages = CookieStorage(request)
+        return request
+
+    def test_get_queryset(self):
+        model_admin = HideableModelAdmin(HideableChildModel, self.site)
+        self.assertEquals([self.hcm1, self.hcm2, self.hcm3],
+                          list(model_admin.get_queryset(self._request(self.superuser))))
+        self.assertEquals([self.hcm1, self.hcm3],
+                          list(model_admin.get_queryset(self._request(self.staff))))
+
+        model_admin = StaffHideableModelAdmin(HideableChildModel, self.site)
+        self.assertEquals([self.hcm1, self.hcm2, self.hcm3],
+                          list(model_admin.get_queryset(self._request(self.staff))))
+
+    def test_actions(self):
+        model_admin = HideableModelAdmin(HideableChildModel, self.site)
+        request = self._request(self.superuser)
+        self.assertEquals(set(["delete_selected", "hide_selected", "restore_selected"]),
+                          set(model_admin.get_actions(request)))
+
+        queryset = model_admin.get_queryset(request).filter(pk__in=[self.hcm1.pk, self.hcm2.pk])
+        with self.assertNumQueries(1):
+            model_admin.hide_selected(request, queryset)
+        self.assertEquals([self.hcm3], list(HideableChildModel.objects.all()))
+        with self.assertNumQueries(1):
+            model_admin.restore_selected(request, queryset)
+        self.assertEquals(3, HideableChildModel.objects.count())
+        self.assertEquals(["Hid 1 hideable child models.", "Restored 2 hideable child models."],
+                          [str(message) for message in request._messages])
+
+        # staff users can't restore what they can't see
+        model_admin = HideableModelAdmin(HideableChildModel, self.site)
+        self.assertFalse("restore_selected" in model_admin.get_actions(self._request(self.staff)))
+
+    def test_delete(self):
+        model_admin = HideableModelAdmin(HideableChildModel, self.site)
+        model_admin.delete_queryset(self._request(self.staff),
+                                    HideableChildModel.objects.filter(pk=self.hcm1.pk))
+        model_admin.delete_model(self._request(self.staff), self.hcm3)
+        self.assertEquals(3, HideableChildModel.objects.filter(include_hidden=True).count())
+        self.assertEquals(0, HideableChildModel.objects.count())
+
+        model_admin.delete_model(self._request(self.superuser), self.hcm3)
+        model_admin = StaffHideableModelAdmin(HideableChildModel, self.site)
+        model_admin.delete_queryset(self._request(self.staff),
+                                    HideableChildModel.objects.filter(include_hidden=True,
+                                                                      pk=self.hcm1.pk))
+        self.assertEquals([self.hcm2], list(HideableChildModel.objects.filter(
+                                                include_hidden=True)))
+
+    def test_changelist(self):
+        model_admin = HideableModelAdmin(HideableChildModel, self.site)
+        changelist = model_admin.get_changelist_instance(self._request(self.superuser))
+        self.assertEquals(HiddenListFilter, type(changelist.filter_specs[0]))
+        self.assertTrue(isinstance(changelist.paginator, EstimatedCountPaginator))
+        self.assertEquals(3, changelist.result_count)
+        self.assertEquals(None, changelist.full_result_count)
+
+        changelist = model_admin.get_changelist_instance(self._request(self.superuser,
+                                                                       hidden="1"))
+        self.assertEquals([self.hcm2], list(changelist.result_list))
+        changelist = model_admin.get_changelist_instance(self._request(self.superuser,
+                                                                       hidden="0"))
+        self.assertEquals(2, changelist.result_count)
+
+        changelist = model_admin.get_changelist_instance(self._request(self.staff))
+        self.assertEquals([], changelist.filter_specs)
+        self.assertEquals(2, changelist.result_count)
+
+    def test_changelist__counts(self):
+        cache.clear()
+        CountedHiddenModel.objects.create(name="test-2213", category="a")
+        CountedHiddenModel.objects.create(name="test-2214", category="a", deleted=True)
+        model_admin = HideableModelAdmin(CountedHiddenModel, self.site)
+        CountedHiddenModel.objects.counts()
+        changelist = model_admin.get_changelist_instance(self._request(self.superuser))
+        with self.assertNumQueries(0):
+            self.assertEquals(2, changelist.paginator.count)
+
+    def test_changelist__estimate(self):
+        # EXPLAIN output comes back as a list of plans, or as the single plan
+        # when psycopg has already decoded the json column
+        plan = {"Plan": {"Plan Rows": 150000}}
+        for output in [[plan], plan]:
+            paginator = EstimatedCountPaginator(HideableChildModel.objects.all(), 10)
+            with mock.patch.object(connection, "vendor", "postgresql"), \
+                    mock.patch.object(QuerySet, "explain", return_value=json.dumps(output)):
+                self.assertEquals(150000, paginator.count)
+        
+        paginator = EstimatedCountPaginator(HideableChildModel.objects.all(), 10)
+        paginator.estimate_threshold = 150001
+        with mock.patch.object(connection, "vendor", "postgresql"), \
+                mock.patch.object(QuerySet, "explain", return_value=json.dumps(plan)):
+            self.assertEquals(2, paginator.count)
+    
+    def test_list_prefetch_related(self):
+        hm = HiddenModel.objects.create(name="test-2215")
+        rhm1 = RelatedHiddenModel.objects.create(name="test-2215", parent=hm)
+        RelatedHiddenModel.objects.create(name="test-2216", parent=hm, deleted=True)
+
+        model_admin = HideableModelAdmin(HiddenModel, self.site)
+        model_admin.list_prefetch_related = ("children",)
+        changelist = model_admin.get_changelist_instance(self._request(self.staff))
+        with self.assertNumQueries(2):
+            self.assertEquals([[rhm1]], [list(obj.children.all())
+                                         for obj in changelist.result_list])
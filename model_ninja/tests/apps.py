@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ModelNinjaTestsConfig(AppConfig):
+    """
+    App of the test models. Add 'model_ninja.tests' to INSTALLED_APPS to run
+    the tests.
+    """
+    name = 'model_ninja.tests'
+    label = 'model_ninja_tests'
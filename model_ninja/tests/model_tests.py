@@ -1,9 +1,34 @@
-from django.core.exceptions import MultipleObjectsReturned
-from django.db import models
-from django.test import TestCase
+import datetime
+from io import StringIO
+from unittest import mock
 
-from model_ninja.models import HiddenModel, CustomHiddenModel
+from django.apps import apps
+from django.apps.registry import Apps
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import (FieldDoesNotExist, ImproperlyConfigured,
+                                    MultipleObjectsReturned)
+from django.core.exceptions import ValidationError
+from django.db import connection, models, IntegrityError, transaction
+from django.db.models import sql, Prefetch
+from django.utils import timezone
+from django.db.migrations.state import ProjectState
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import isolate_apps
+
+from model_ninja.tests.models import (ArchivedHiddenModel, CachedHiddenModel, CountedHiddenModel,
+                                      HiddenModel, CustomHiddenModel, HideableChildModel,
+                                      OutboxHiddenModel, RankedHiddenModel, RelatedHiddenModel,
+                                      TimestampedHiddenModel, UniqueHiddenModel,
+                                      ViewHiddenModel, VisibleUniqueModel)
+from model_ninja.db import instrumentation
+from model_ninja.db.cache import memoize, ObjectCache
+from model_ninja.db.counts import Counts, CountedPaginator
 from model_ninja.db.models import *
+from model_ninja.db.outbox import ChangeFeed
+from model_ninja.db.operations import (AddVisibleIndex, CreateVisibleView, RemoveVisibleIndex,
+                                      RemoveVisibleView)
 
 
 class HideableModelManagerTests(TestCase):
@@ -343,4 +368,1183 @@ class HideableModelManagerTests(TestCase):
                                     name=name, disabled=disabled, defaults={"disabled": disabled})
                     self.assertEquals(disabled, chm.disabled)
                     self.assertFalse(created)
+    
+    def test_get_or_create__upsert(self):
+        # unique lookup, model doesn't exist: the SELECT, then a single
+        # INSERT ... ON CONFLICT in a savepoint
+        with self.assertNumQueries(4):
+            uhm1, created = UniqueHiddenModel.objects.get_or_create(name="test-4410")
+        self.assertTrue(created)
+        self.assertFalse(uhm1.deleted)
+        self.assertEquals(uhm1, UniqueHiddenModel.objects.get(name="test-4410"))
+        
+        # unique lookup, non-hidden model exists: only the SELECT
+        with self.assertNumQueries(1):
+            uhm2, created = UniqueHiddenModel.objects.get_or_create(name="test-4410")
+        self.assertEquals(uhm1, uhm2)
+        self.assertFalse(created)
+        self.assertEquals(1, UniqueHiddenModel.objects.count())
+        
+        # unique lookup, another writer inserts the object after the SELECT
+        with mock.patch.object(HideableModelManager, "get",
+                               side_effect=[UniqueHiddenModel.DoesNotExist, uhm1]) as get:
+            self.assertEquals((uhm1, False),
+                              UniqueHiddenModel.objects.get_or_create(name="test-4410"))
+        self.assertEquals(2, get.call_count)
+        self.assertEquals(1, UniqueHiddenModel.objects.count())
+        
+        # unique lookup, defaults used on creation only
+        uhm3, created = UniqueHiddenModel.objects.get_or_create(name="test-0712",
+                                                                defaults={"deleted": True})
+        self.assertTrue(created)
+        self.assertTrue(uhm3.deleted)
+        
+        # unique lookup, hidden model exists, no defaults or hidden field specified
+        self.assertRaises(HiddenObjectError, UniqueHiddenModel.objects.get_or_create,
+                          name="test-0712")
+        
+        # unique lookup, hidden model exists, hidden field in defaults
+        uhm4, created = UniqueHiddenModel.objects.get_or_create(name="test-0712",
+                                                                defaults={"deleted": False})
+        self.assertEquals(uhm3, uhm4)
+        self.assertTrue(uhm4.deleted)
+        self.assertFalse(created)
+        
+        # hidden field in the lookup doesn't match the constraint, regular path
+        uhm5, created = UniqueHiddenModel.objects.get_or_create(name="test-0712",
+                                                                deleted=True)
+        self.assertEquals(uhm3, uhm5)
+        self.assertFalse(created)
+    
+    def test_get_or_create__required_fields(self):
+        # a lookup that leaves a NOT NULL field unset can't be an upsert, as
+        # the INSERT fails on the missing value before it can conflict
+        rhm1 = RankedHiddenModel.objects.create(name="test-4420", rank=1)
+        self.assertEquals((rhm1, False),
+                          RankedHiddenModel.objects.get_or_create(name="test-4420"))
+        rhm2, created = RankedHiddenModel.objects.get_or_create(name="test-4421",
+                                                                defaults={"rank": 2})
+        self.assertTrue(created)
+        self.assertEquals(2, rhm2.rank)
+    
+    def test_hide(self):
+        # default, single update
+        hm1 = HiddenModel.objects.create(name="test-2208")
+        hm2 = HiddenModel.objects.create(name="test-2208")
+        hm3 = HiddenModel.objects.create(name="test-5613")
+        with self.assertNumQueries(1):
+            self.assertEquals(2, HiddenModel.objects.hide(name="test-2208"))
+        self.assertEquals([hm3], list(HiddenModel.objects.all()))
+        self.assertEquals(0, HiddenModel.objects.hide(name="test-2208"))
+        
+        # default, batched, on a queryset
+        for i in range(5):
+            HiddenModel.objects.create(name="test-9154")
+        with self.assertNumQueries(7):
+            self.assertEquals(5, HiddenModel.objects.filter(name="test-9154").hide(chunk_size=2))
+        self.assertEquals([], list(HiddenModel.objects.filter(name="test-9154")))
+        
+        # custom
+        chm1 = CustomHiddenModel.objects.create(name="test-2208")
+        self.assertEquals(1, CustomHiddenModel.objects.hide(name="test-2208", chunk_size=10))
+        self.assertTrue(CustomHiddenModel.objects.get(include_hidden=True, pk=chm1.pk).disabled)
+    
+    def test_unhide(self):
+        # default
+        hm1 = HiddenModel.objects.create(name="test-3021", deleted=True)
+        hm2 = HiddenModel.objects.create(name="test-3021", deleted=False)
+        self.assertEquals(1, HiddenModel.objects.unhide(name="test-3021"))
+        self.assertEquals([hm1, hm2], list(HiddenModel.objects.filter(name="test-3021")))
+        
+        # default, batched, visible-only queryset has nothing to restore
+        HiddenModel.objects.hide(name="test-3021")
+        self.assertEquals(0, HiddenModel.objects.filter(name="test-3021").unhide())
+        self.assertEquals(2, HiddenModel.objects.filter(include_hidden=True,
+                                                        name="test-3021").unhide(chunk_size=1))
+        
+        # custom
+        CustomHiddenModel.objects.create(name="test-3021", disabled=True)
+        self.assertEquals(1, CustomHiddenModel.objects.unhide(name="test-3021"))
+        self.assertEquals(1, CustomHiddenModel.objects.filter(name="test-3021").count())
+    
+    def test_purge_hidden(self):
+        # default, only hidden objects are deleted
+        HiddenModel.objects.create(name="test-7720", deleted=True)
+        HiddenModel.objects.create(name="test-7720", deleted=True)
+        hm1 = HiddenModel.objects.create(name="test-7720", deleted=False)
+        self.assertEquals(2, HiddenModel.objects.purge_hidden(name="test-7720", chunk_size=1))
+        self.assertEquals([hm1], list(HiddenModel.objects.filter(include_hidden=True,
+                                                                 name="test-7720")))
+        
+        # custom
+        CustomHiddenModel.objects.create(name="test-7720", disabled=True)
+        self.assertEquals(1, CustomHiddenModel.objects.purge_hidden())
+        
+        # 'older_than' needs a hidden timestamp field
+        self.assertRaises(FieldDoesNotExist, HiddenModel.objects.purge_hidden,
+                          older_than=datetime.timedelta(days=30))
+
+
+class HideableQuerySetTests(TestCase):
+    def setUp(self):
+        self.hm1 = HiddenModel.objects.create(name="test-6012", deleted=False)
+        self.hm2 = HiddenModel.objects.create(name="test-6012", deleted=True)
+        self.hm3 = HiddenModel.objects.create(name="test-1873", deleted=False)
+    
+    def _where(self, queryset):
+        return str(queryset.query).split(" WHERE ")[1]
+    
+    def test_chained_filters(self):
+        queryset = HiddenModel.objects.filter(name="test-6012").filter(pk__gte=0)
+        self.assertEquals([self.hm1], list(queryset))
+        self.assertEquals(1, self._where(queryset).count('"deleted"'))
+        
+        # explicit hidden field lookup replaces the implicit predicate
+        queryset = HiddenModel.objects.filter(deleted=False).filter(name="test-6012")
+        self.assertEquals(1, self._where(queryset).count('"deleted"'))
+        self.assertEquals([self.hm2], list(HiddenModel.objects.all().filter(deleted=True)))
+        
+        # include_hidden later in the chain
+        queryset = HiddenModel.objects.filter(name="test-6012").filter(include_hidden=True)
+        self.assertEquals([self.hm1, self.hm2], list(queryset))
+        self.assertEquals([self.hm1, self.hm2],
+                          list(HiddenModel.objects.all().include_hidden().filter(name="test-6012")))
+        self.assertEquals([self.hm1],
+                          list(queryset.include_hidden(False)))
+    
+    def test_queryset_methods(self):
+        objects = HiddenModel.objects
+        self.assertEquals(2, objects.count())
+        self.assertEquals(3, objects.all(include_hidden=True).count())
+        self.assertEquals([self.hm3], list(objects.exclude(name="test-6012")))
+        self.assertEquals([self.hm2, self.hm3],
+                          list(objects.exclude(include_hidden=True, pk=self.hm1.pk)))
+        self.assertFalse(objects.filter(pk=self.hm2.pk).exists())
+        self.assertEquals(["test-6012", "test-1873"], list(objects.values_list("name", flat=True)))
+        self.assertEquals(self.hm3.pk, objects.aggregate(models.Max("pk"))["pk__max"])
+        self.assertEquals(set([self.hm1.pk, self.hm3.pk]),
+                          set(objects.in_bulk([self.hm1.pk, self.hm2.pk, self.hm3.pk])))
+        self.assertEquals([self.hm1, self.hm3], list(objects.iterator()))
+        self.assertEquals([self.hm1], list(objects.filter(pk__in=objects.filter(name="test-6012"))))
+    
+    def test_query_clones(self):
+        # the predicate is added to the copies Django makes for COUNT, EXISTS,
+        # aggregates and subqueries; a SELECT adds one copy per query
+        def clones(manager, func):
+            with mock.patch.object(sql.Query, "clone", autospec=True,
+                                   side_effect=sql.Query.clone) as clone:
+                func(manager)
+            return clone.call_count
+        
+        for func in [lambda objects: objects.count(),
+                     lambda objects: objects.filter(pk=self.hm2.pk).exists(),
+                     lambda objects: objects.aggregate(models.Max("pk")),
+                     lambda objects: objects.filter(pk__in=objects.filter(name="test-6012"))
+                                            .count()]:
+            self.assertEquals(clones(HiddenModel._base_manager, func),
+                              clones(HiddenModel.objects, func))
+        
+        def select(objects):
+            queryset = objects.filter(name="test-6012")
+            list(queryset.iterator())
+            list(queryset.iterator())
+        self.assertEquals(clones(HiddenModel._base_manager, select) + 1,
+                          clones(HiddenModel.objects, select))
+    
+    def test_update_delete(self):
+        self.assertEquals(1, HiddenModel.objects.filter(name="test-6012").update(name="test-0001"))
+        self.assertEquals("test-6012", HiddenModel.objects.get(include_hidden=True, pk=self.hm2.pk).name)
+        HiddenModel.objects.all().delete()
+        self.assertEquals([self.hm2], list(HiddenModel.objects.all(include_hidden=True)))
+        
+        # explicit objects are updated whether or not they are hidden
+        self.hm2.name = "test-0002"
+        HiddenModel.objects.bulk_update([self.hm2], ["name"])
+        self.assertEquals("test-0002", HiddenModel.objects.get(include_hidden=True, pk=self.hm2.pk).name)
+    
+    def test_as_manager(self):
+        class CustomHiddenQuerySet(HideableQuerySet):
+            hidden_field_name = "disabled"
+        
+        manager = CustomHiddenQuerySet.as_manager()
+        self.assertTrue(isinstance(manager, HideableModelManager))
+        self.assertEquals("disabled", manager.hidden_field_name)
+        self.assertEquals("disabled", type(manager).hidden_field_name)
+
+
+class RelatedManagerTests(TestCase):
+    def setUp(self):
+        self.hm1 = HiddenModel.objects.create(name="test-4031")
+        self.hm2 = HiddenModel.objects.create(name="test-4032")
+        self.rhm1 = RelatedHiddenModel.objects.create(name="test-4031", parent=self.hm1)
+        self.rhm2 = RelatedHiddenModel.objects.create(name="test-4031", parent=self.hm1,
+                                                      deleted=True)
+        self.rhm3 = RelatedHiddenModel.objects.create(name="test-4032", parent=self.hm2)
+        self.chm1 = CustomHiddenModel.objects.create(name="test-4031")
+        self.chm2 = CustomHiddenModel.objects.create(name="test-4032", disabled=True)
+        self.rhm1.tags.add(self.chm1, self.chm2)
+    
+    def test_reverse_foreign_key(self):
+        self.assertEquals([self.rhm1], list(self.hm1.children.all()))
+        self.assertEquals(1, self.hm1.children.count())
+        self.assertEquals([self.rhm1, self.rhm2], list(self.hm1.children.all(include_hidden=True)))
+        self.assertEquals([self.rhm2], list(self.hm1.children.filter(deleted=True)))
+        self.assertEquals([self.rhm1, self.rhm2], list(self.hm1.children.include_hidden()))
+    
+    def test_many_to_many(self):
+        self.assertEquals([self.chm1], list(self.rhm1.tags.all()))
+        self.assertEquals([self.chm1, self.chm2], list(self.rhm1.tags.all(include_hidden=True)))
+        self.assertEquals([self.rhm1], list(self.chm1.related.all()))
+        
+        # reverse side, hidden related object
+        self.chm2.related.add(self.rhm2)
+        self.assertEquals([self.rhm1], list(self.chm2.related.all()))
+        self.assertEquals([self.rhm1, self.rhm2], list(self.chm2.related.all(include_hidden=True)))
+    
+    def test_prefetch_related(self):
+        with self.assertNumQueries(2):
+            parents = list(HiddenModel.objects.prefetch_related("children").order_by("pk"))
+            self.assertEquals([[self.rhm1], [self.rhm3]],
+                              [list(parent.children.all()) for parent in parents])
+        
+        with self.assertNumQueries(2):
+            children = list(RelatedHiddenModel.objects.prefetch_related("tags"))
+            self.assertEquals([[self.chm1], []], [list(child.tags.all()) for child in children])
+        
+        # include hidden objects with an explicit Prefetch queryset
+        queryset = RelatedHiddenModel.objects.include_hidden()
+        with self.assertNumQueries(2):
+            parents = list(HiddenModel.objects.prefetch_related(
+                            Prefetch("children", queryset=queryset)).order_by("pk"))
+            self.assertEquals([[self.rhm1, self.rhm2], [self.rhm3]],
+                              [list(parent.children.all()) for parent in parents])
+
+
+class CascadeHideTests(TestCase):
+    def setUp(self):
+        self.hm1 = HiddenModel.objects.create(name="test-8101")
+        self.hm2 = HiddenModel.objects.create(name="test-8102")
+        self.rhm1 = RelatedHiddenModel.objects.create(name="test-8101", parent=self.hm1)
+        self.rhm2 = RelatedHiddenModel.objects.create(name="test-8101", parent=self.hm1)
+        self.rhm3 = RelatedHiddenModel.objects.create(name="test-8102", parent=self.hm2)
+        self.hcm1 = HideableChildModel.objects.create(name="test-8101", parent=self.rhm1)
+        self.hcm2 = HideableChildModel.objects.create(name="test-8102", parent=self.rhm3)
+        self.chm1 = CustomHiddenModel.objects.create(name="test-8101")
+        self.rhm2.tags.add(self.chm1)
+    
+    def test_hide_cascade(self):
+        # one query per model and relation walked, one update per model
+        with self.assertNumQueries(8):
+            self.assertEquals(1, HiddenModel.objects.hide(pk=self.hm1.pk, cascade=True))
+        self.assertEquals([self.hm2], list(HiddenModel.objects.all()))
+        self.assertEquals([self.rhm3], list(RelatedHiddenModel.objects.all()))
+        self.assertEquals([self.hcm2], list(HideableChildModel.objects.all()))
+        
+        # ignored relation
+        self.assertEquals([self.chm1], list(CustomHiddenModel.objects.all()))
+        
+        # without cascade only the objects themselves are hidden
+        self.assertEquals(1, HiddenModel.objects.hide(pk=self.hm2.pk))
+        self.assertEquals([self.rhm3], list(RelatedHiddenModel.objects.all()))
+    
+    def test_unhide_cascade(self):
+        HiddenModel.objects.hide(cascade=True)
+        self.assertEquals(1, HiddenModel.objects.unhide(pk=self.hm1.pk, cascade=True))
+        self.assertEquals([self.hm1], list(HiddenModel.objects.all()))
+        self.assertEquals([self.rhm1, self.rhm2], list(RelatedHiddenModel.objects.all()))
+        self.assertEquals([self.hcm1], list(HideableChildModel.objects.all()))
+    
+    def test_hide_protect(self):
+        self.assertRaises(HideProtectedError, CustomHiddenModel.objects.hide,
+                          pk=self.chm1.pk, cascade=True)
+        self.assertEquals([self.chm1], list(CustomHiddenModel.objects.all()))
+        
+        # hidden objects don't protect
+        self.rhm2.deleted = True
+        self.rhm2.save()
+        self.assertEquals(1, CustomHiddenModel.objects.hide(pk=self.chm1.pk, cascade=True))
+    
+    def test_instance_hide(self):
+        self.hcm1.hide()
+        self.assertTrue(self.hcm1.deleted)
+        self.assertEquals([self.hcm2], list(HideableChildModel.objects.all()))
+        self.hcm1.unhide()
+        self.assertFalse(self.hcm1.deleted)
+        self.assertEquals([self.hcm1, self.hcm2], list(HideableChildModel.objects.all()))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.ahm1 = ArchivedHiddenModel.objects.create(name="test-5120")
+        self.ahm2 = ArchivedHiddenModel.objects.create(name="test-5121")
+        self.ahm3 = ArchivedHiddenModel.objects.create(name="test-5121")
+        self.archive = ArchivedHiddenModel.archive_model
+    
+    def _main_pks(self):
+        return list(ArchivedHiddenModel._base_manager.values_list("pk", flat=True))
+    
+    def _archived_pks(self):
+        return list(self.archive._base_manager.values_list("pk", flat=True))
+    
+    def test_archive_model(self):
+        self.assertEquals("model_ninja_tests_archivedhiddenmodel_hidden", self.archive._meta.db_table)
+        self.assertEquals([field.column for field in ArchivedHiddenModel._meta.concrete_fields],
+                          [field.column for field in self.archive._meta.concrete_fields])
+    
+    def test_hide(self):
+        self.assertEquals(2, ArchivedHiddenModel.objects.hide(name="test-5121"))
+        self.assertEquals([self.ahm1.pk], self._main_pks())
+        self.assertEquals([self.ahm2.pk, self.ahm3.pk], self._archived_pks())
+        self.assertEquals([self.ahm1], list(ArchivedHiddenModel.objects.all()))
+        
+        # include_hidden reads both tables
+        objects = ArchivedHiddenModel.objects
+        self.assertEquals([self.ahm1, self.ahm2, self.ahm3],
+                          list(objects.all(include_hidden=True).order_by("pk")))
+        self.assertEquals(3, objects.all(include_hidden=True).count())
+        self.assertEquals([self.ahm3], list(objects.filter(include_hidden=True, name="test-5121")
+                                                   .order_by("-pk")[:1]))
+        self.assertTrue(objects.get(deleted=True, pk=self.ahm2.pk).deleted)
+        
+        # instance hide
+        self.ahm1.hide()
+        self.assertEquals([], self._main_pks())
+    
+    def test_unhide(self):
+        ArchivedHiddenModel.objects.hide()
+        self.assertEquals(2, ArchivedHiddenModel.objects.unhide(name="test-5121"))
+        self.assertEquals([self.ahm2.pk, self.ahm3.pk], self._main_pks())
+        self.assertEquals([self.ahm2, self.ahm3], list(ArchivedHiddenModel.objects.all()))
+        self.ahm1.unhide()
+        self.assertEquals([self.ahm1, self.ahm2, self.ahm3],
+                          list(ArchivedHiddenModel.objects.order_by("pk")))
+        self.assertEquals([], self._archived_pks())
+    
+    def test_archive_hidden(self):
+        # rows hidden without the hide methods stay until swept
+        ahm4 = ArchivedHiddenModel.objects.create(name="test-5122", deleted=True)
+        ahm5 = ArchivedHiddenModel.objects.create(name="test-5122", deleted=True)
+        self.assertEquals([], self._archived_pks())
+        self.assertEquals(2, ArchivedHiddenModel.objects.archive_hidden(chunk_size=1))
+        self.assertEquals([ahm4.pk, ahm5.pk], self._archived_pks())
+        self.assertEquals(0, ArchivedHiddenModel.objects.archive_hidden())
+        self.assertRaises(ImproperlyConfigured, HiddenModel.objects.archive_hidden)
+    
+    def test_save(self):
+        # saving an archived object updates the archived row rather than
+        # inserting a second copy into the main table
+        ArchivedHiddenModel.objects.hide(name="test-5121")
+        ahm2 = ArchivedHiddenModel.objects.get(include_hidden=True, pk=self.ahm2.pk)
+        ahm2.name = "test-5123"
+        ahm2.save()
+        self.assertEquals([self.ahm1.pk], self._main_pks())
+        self.assertEquals("test-5123",
+                          ArchivedHiddenModel.objects.get(include_hidden=True, pk=ahm2.pk).name)
+        
+        self.assertEquals(1, ArchivedHiddenModel.objects.unhide(pk=ahm2.pk))
+        self.assertEquals([self.ahm1.pk, ahm2.pk], self._main_pks())
+        self.assertEquals("test-5123", ArchivedHiddenModel.objects.get(pk=ahm2.pk).name)
+        
+        # and one that is no longer hidden goes back to the main table
+        ahm3 = ArchivedHiddenModel.objects.get(include_hidden=True, pk=self.ahm3.pk)
+        ahm3.deleted = False
+        ahm3.save()
+        self.assertEquals([], self._archived_pks())
+        self.assertEquals([self.ahm1, ahm2, ahm3], list(ArchivedHiddenModel.objects.order_by("pk")))
+    
+    @isolate_apps("model_ninja.tests")
+    def test_references(self):
+        # archiving deletes rows from the main table, so nothing may refer to them
+        class ArchivedTargetModel(AbstractHideableModel):
+            archive_mode = ARCHIVE_ON_HIDE
+            
+            class Meta:
+                app_label = "model_ninja_tests"
+        
+        class ArchivedReferrerModel(models.Model):
+            target = models.ForeignKey(ArchivedTargetModel, on_delete=models.CASCADE)
+            
+            class Meta:
+                app_label = "model_ninja_tests"
+        
+        def error_ids(model):
+            return [error.id for error in model.check() if error.id.startswith("model_ninja")]
+        self.assertEquals(["model_ninja.E001"], error_ids(ArchivedTargetModel))
+        self.assertEquals([], error_ids(ArchivedHiddenModel))
+    
+    def test_purge_hidden(self):
+        ArchivedHiddenModel.objects.hide(name="test-5121")
+        ArchivedHiddenModel.objects.create(name="test-5122", deleted=True)
+        self.assertEquals(3, ArchivedHiddenModel.objects.purge_hidden())
+        self.assertEquals([self.ahm1.pk], self._main_pks())
+        self.assertEquals([], self._archived_pks())
+
+
+class TimestampTests(TestCase):
+    def setUp(self):
+        self.thm1 = TimestampedHiddenModel.objects.create(name="test-2310")
+        self.thm2 = TimestampedHiddenModel.objects.create(name="test-2311")
+        self.thm3 = TimestampedHiddenModel.objects.create(name="test-2312")
+    
+    def _hidden_at(self):
+        return dict(TimestampedHiddenModel.objects.filter(include_hidden=True)
+                                                  .values_list("name", "hidden_at"))
+    
+    def _age(self, days, **kwargs):
+        TimestampedHiddenModel.objects.filter(include_hidden=True, **kwargs).update(
+            hidden_at=timezone.now() - datetime.timedelta(days=days))
+    
+    def test_hidden_at(self):
+        before = timezone.now()
+        self.assertEquals(2, TimestampedHiddenModel.objects.hide(name__in=["test-2310", 
+                                                                           "test-2311"]))
+        hidden_at = self._hidden_at()
+        self.assertTrue(hidden_at["test-2310"] >= before)
+        self.assertEquals(hidden_at["test-2310"], hidden_at["test-2311"])
+        self.assertEquals(None, hidden_at["test-2312"])
+        
+        self.thm3.hide()
+        self.assertTrue(self.thm3.hidden_at >= before)
+        self.assertEquals(self.thm3.hidden_at, self._hidden_at()["test-2312"])
+        
+        # restoring clears the timestamp
+        self.thm3.unhide()
+        self.assertEquals(None, self.thm3.hidden_at)
+        self.assertEquals(1, TimestampedHiddenModel.objects.unhide(name="test-2310"))
+        self.assertEquals(None, self._hidden_at()["test-2310"])
+    
+    def test_purge_hidden(self):
+        TimestampedHiddenModel.objects.hide()
+        self._age(40, name="test-2310")
+        self._age(10, name="test-2311")
+        self.assertEquals(1, TimestampedHiddenModel.objects.purge_hidden(
+                                 older_than=datetime.timedelta(days=30)))
+        self.assertEquals(set(["test-2311", "test-2312"]), set(self._hidden_at()))
+        self.assertEquals(1, TimestampedHiddenModel.objects.purge_hidden(
+                                 older_than=timezone.now() - datetime.timedelta(days=5)))
+    
+    def test_index(self):
+        index = [index for index in TimestampedHiddenModel._meta.indexes
+                 if index.fields == ["hidden_at"]][0]
+        self.assertEquals(models.Q(deleted=True), index.condition)
+        self.assertTrue(index.name.endswith("_hid"))
+        self.assertEquals([], [index for index in HiddenModel._meta.indexes
+                               if index.name.endswith("_hid")])
+    
+    def test_sweep_hidden(self):
+        TimestampedHiddenModel.objects.hide()
+        self._age(40)
+        self._age(10, name="test-2312")
+        out = StringIO()
+        call_command("sweep_hidden", "model_ninja_tests.TimestampedHiddenModel", older_than=30,
+                     chunk_size=1, stdout=out)
+        self.assertEquals(["test-2312"], list(self._hidden_at()))
+        self.assertTrue("last pk %s" % self.thm2.pk in out.getvalue())
+        
+        # resumes after the given pk, stops after 'max_batches'
+        HiddenModel.objects.create(name="test-2313", deleted=True)
+        hm2 = HiddenModel.objects.create(name="test-2313", deleted=True)
+        hm3 = HiddenModel.objects.create(name="test-2313", deleted=True)
+        call_command("sweep_hidden", "model_ninja_tests.HiddenModel", start_after=hm2.pk - 1,
+                     chunk_size=1, max_batches=1, stdout=StringIO())
+        self.assertEquals(2, HiddenModel.objects.filter(include_hidden=True).count())
+        self.assertTrue(HiddenModel.objects.filter(include_hidden=True, pk=hm3.pk).exists())
+        
+        # 'older_than' needs a hidden timestamp, 'archive' an archive table
+        self.assertRaises(CommandError, call_command, "sweep_hidden", 
+                          "model_ninja_tests.HiddenModel", older_than=30)
+        self.assertRaises(CommandError, call_command, "sweep_hidden",
+                          "model_ninja_tests.HiddenModel", archive=True)
+    
+    def test_sweep_hidden__rehidden(self):
+        # an object hidden again after its batch was selected is kept
+        TimestampedHiddenModel.objects.hide()
+        self._age(40)
+        original_filter = HideableModelManager.filter
+        
+        def rehide(manager, *args, **kwargs):
+            if "pk__in" in kwargs:
+                self.thm1.unhide()
+                self.thm1.hide()
+            return original_filter(manager, *args, **kwargs)
+        with mock.patch.object(HideableModelManager, "filter", rehide):
+            call_command("sweep_hidden", "model_ninja_tests.TimestampedHiddenModel",
+                         older_than=30, chunk_size=10, stdout=StringIO())
+        self.assertEquals(["test-2310"], list(self._hidden_at()))
+    
+    def test_sweep_hidden__archive(self):
+        ArchivedHiddenModel.objects.create(name="test-2314", deleted=True)
+        out = StringIO()
+        call_command("sweep_hidden", "model_ninja_tests.ArchivedHiddenModel", archive=True,
+                     stdout=out)
+        self.assertTrue("1 objects swept" in out.getvalue())
+        self.assertEquals(0, ArchivedHiddenModel._base_manager.count())
+        self.assertEquals(1, ArchivedHiddenModel.archive_model.objects.count())
+
+
+class AsyncTests(TestCase):
+    def setUp(self):
+        self.hm1 = HiddenModel.objects.create(name="test-6610")
+        self.hm2 = HiddenModel.objects.create(name="test-6611", deleted=True)
+    
+    async def test_aget(self):
+        self.assertEquals(self.hm1, await HiddenModel.objects.aget(name="test-6610"))
+        with self.assertRaises(HiddenModel.DoesNotExist):
+            await HiddenModel.objects.aget(name="test-6611")
+        self.assertEquals(self.hm2, await HiddenModel.objects.aget(name="test-6611",
+                                                                   include_hidden=True))
+    
+    async def test_acount__aiter(self):
+        self.assertEquals(1, await HiddenModel.objects.acount())
+        self.assertEquals(2, await HiddenModel.objects.filter(include_hidden=True).acount())
+        self.assertEquals([self.hm1], [obj async for obj in HiddenModel.objects.all()])
+        self.assertEquals([self.hm1], [obj async for obj in
+                                       HiddenModel.objects.filter(name__startswith="test")])
+    
+    async def test_aget_or_create(self):
+        obj, created = await HiddenModel.objects.aget_or_create(name="test-6610")
+        self.assertEquals((self.hm1, False), (obj, created))
+        with self.assertRaises(HiddenObjectError):
+            await HiddenModel.objects.aget_or_create(name="test-6611")
+        obj, created = await HiddenModel.objects.aget_or_create(name="test-6611", deleted=True)
+        self.assertEquals((self.hm2, False), (obj, created))
+    
+    async def test_ahide__aunhide(self):
+        self.assertEquals(1, await HiddenModel.objects.ahide(name="test-6610"))
+        self.assertEquals(0, await HiddenModel.objects.acount())
+        self.assertEquals(2, await HiddenModel.objects.filter(include_hidden=True).aunhide())
+        
+        child = await HideableChildModel.objects.acreate(name="test-6612")
+        await child.ahide()
+        self.assertTrue(child.deleted)
+        self.assertEquals(0, await HideableChildModel.objects.acount())
+        await child.aunhide()
+        self.assertEquals(1, await HideableChildModel.objects.acount())
+
+
+class BulkGetOrCreateTests(TestCase):
+    def setUp(self):
+        self.uhm1 = UniqueHiddenModel.objects.create(name="test-4410")
+        self.uhm2 = UniqueHiddenModel.objects.create(name="test-4411", deleted=True)
+    
+    def test_bulk_get_or_create(self):
+        lookups = ({"name": name} for name in ("test-4410", "test-4411", "test-4412", 
+                                               "test-4413", "test-4412"))
+        # per batch, one SELECT and one INSERT (in a savepoint)
+        with self.assertNumQueries(2 * 4):
+            results = list(UniqueHiddenModel.objects.bulk_get_or_create(lookups, 
+                                                                        batch_size=3))
+        self.assertEquals([("test-4410", BULK_EXISTING), ("test-4411", BULK_HIDDEN),
+                           ("test-4412", BULK_CREATED), ("test-4413", BULK_CREATED),
+                           ("test-4412", BULK_EXISTING)],
+                          [(lookup["name"], status) for lookup, obj, status in results])
+        self.assertEquals(self.uhm2, results[1][1])
+        self.assertEquals(results[2][1], results[4][1])
+        self.assertEquals(3, UniqueHiddenModel.objects.count())
+        self.assertEquals(4, UniqueHiddenModel.objects.filter(include_hidden=True).count())
+    
+    def test_bulk_get_or_create__fields(self):
+        # the hidden field as a lookup field matches hidden objects
+        results = list(UniqueHiddenModel.objects.bulk_get_or_create(
+                           [{"name": "test-4411", "deleted": True}]))
+        self.assertEquals([({"name": "test-4411", "deleted": True}, self.uhm2, BULK_EXISTING)],
+                          results)
+        
+        # as does the hidden field in the defaults, like in get_or_create
+        results = list(UniqueHiddenModel.objects.bulk_get_or_create(
+                           [{"name": "test-4411"}], defaults={"deleted": False}))
+        self.assertEquals([({"name": "test-4411"}, self.uhm2, BULK_EXISTING)], results)
+        self.assertEquals((self.uhm2, False), UniqueHiddenModel.objects.get_or_create(
+                                                  name="test-4411", defaults={"deleted": False}))
+        
+        # foreign keys by instance or primary key
+        hm = HiddenModel.objects.create(name="test-4414")
+        rhm = RelatedHiddenModel.objects.create(name="test-4414", parent=hm)
+        results = list(RelatedHiddenModel.objects.bulk_get_or_create(
+                           [{"name": "test-4414", "parent": hm},
+                            {"name": "test-4414", "parent": hm.pk},
+                            {"name": "test-4415", "parent": hm}]))
+        self.assertEquals([BULK_EXISTING, BULK_EXISTING, BULK_CREATED],
+                          [status for lookup, obj, status in results])
+        self.assertEquals(rhm, results[1][1])
+        
+        self.assertRaises(ValueError, list, UniqueHiddenModel.objects.bulk_get_or_create(
+                              [{"name": "test-4416"}, {"name": "test-4416", "deleted": False}]))
+        self.assertRaises(FieldDoesNotExist, list, UniqueHiddenModel.objects.bulk_get_or_create(
+                              [{"name__iexact": "test-4416"}]))
+
+
+class ObjectCacheTests(TestCase):
+    def setUp(self):
+        self.hm1 = CachedHiddenModel.objects.create(name="test-3510")
+        self.hm2 = CachedHiddenModel.objects.create(name="test-3511", deleted=True)
+        CachedHiddenModel.objects.object_cache = ObjectCache(prefix="test")
+        self.addCleanup(setattr, CachedHiddenModel.objects, "object_cache", None)
+        self.addCleanup(CachedHiddenModel.objects.object_cache.shared.clear)
+    
+    def test_get_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEquals(self.hm1, CachedHiddenModel.objects.get_cached(self.hm1.pk))
+        with self.assertNumQueries(0):
+            self.assertEquals(self.hm1, CachedHiddenModel.objects.get_cached(str(self.hm1.pk)))
+        
+        # hidden objects are cached but not returned
+        self.assertRaises(CachedHiddenModel.DoesNotExist, CachedHiddenModel.objects.get_cached, 
+                          self.hm2.pk)
+        with self.assertNumQueries(0):
+            self.assertRaises(CachedHiddenModel.DoesNotExist, CachedHiddenModel.objects.get_cached,
+                              self.hm2.pk)
+            self.assertEquals(self.hm2, CachedHiddenModel.objects.get_cached(self.hm2.pk,
+                                                                       include_hidden=True))
+        
+        with self.assertNumQueries(0):
+            self.assertEquals({self.hm1.pk: self.hm1}, CachedHiddenModel.objects.in_bulk_cached(
+                                                           [self.hm1.pk, self.hm2.pk]))
+    
+    def test_tiers(self):
+        cache = CachedHiddenModel.objects.object_cache
+        CachedHiddenModel.objects.get_cached(self.hm1.pk)
+        
+        # shared tier only
+        cache.local.data.clear()
+        with self.assertNumQueries(0):
+            CachedHiddenModel.objects.get_cached(self.hm1.pk)
+        
+        # per-request memo
+        with memoize():
+            CachedHiddenModel.objects.get_cached(self.hm1.pk)
+            cache.local.data.clear()
+            cache.shared.clear()
+            with self.assertNumQueries(0):
+                CachedHiddenModel.objects.get_cached(self.hm1.pk)
+        
+        # LRU eviction
+        local = ObjectCache(local_size=1, timeout=None, prefix="test-local")
+        local.get_many(CachedHiddenModel.objects, [self.hm1.pk])
+        local.get_many(CachedHiddenModel.objects, [self.hm2.pk])
+        self.assertEquals(1, len(local.local.data))
+        with self.assertNumQueries(1):
+            local.get_many(CachedHiddenModel.objects, [self.hm1.pk])
+    
+    def test_not_cached(self):
+        self.assertRaises(ImproperlyConfigured, HiddenModel.objects.get_cached, self.hm1.pk)
+    
+    def test_invalidation(self):
+        CachedHiddenModel.objects.in_bulk_cached([self.hm1.pk, self.hm2.pk])
+        
+        self.hm1.name = "test-3512"
+        self.hm1.save()
+        self.assertEquals("test-3512", CachedHiddenModel.objects.get_cached(self.hm1.pk).name)
+        
+        CachedHiddenModel.objects.hide(pk=self.hm1.pk)
+        self.assertRaises(CachedHiddenModel.DoesNotExist, CachedHiddenModel.objects.get_cached, 
+                          self.hm1.pk)
+        
+        CachedHiddenModel.objects.filter(include_hidden=True).unhide(chunk_size=1)
+        self.assertEquals(2, len(CachedHiddenModel.objects.in_bulk_cached([self.hm1.pk, 
+                                                                     self.hm2.pk])))
+        
+        CachedHiddenModel.objects.filter(pk=self.hm2.pk).update(name="test-3513")
+        self.assertEquals("test-3513", CachedHiddenModel.objects.get_cached(self.hm2.pk).name)
+        
+        self.hm2.delete()
+        self.assertRaises(CachedHiddenModel.DoesNotExist, CachedHiddenModel.objects.get_cached,
+                          self.hm2.pk)
+    
+    def test_invalidation__without_reads(self):
+        # the receivers are connected with the model, so a process that never
+        # read through the cache still drops what other processes stored
+        cache = CachedHiddenModel.objects.object_cache
+        key = cache._model_prefix(CachedHiddenModel, "default") + str(self.hm1.pk)
+        cache.shared.set(key, (0, False, self.hm1))
+        self.hm1.save()
+        self.assertEquals(None, cache.shared.get(key))
+        
+        cache.shared.set(key, (0, False, self.hm1))
+        CachedHiddenModel.objects.hide(pk=self.hm1.pk)
+        self.assertRaises(CachedHiddenModel.DoesNotExist, CachedHiddenModel.objects.get_cached,
+                          self.hm1.pk)
+
+
+class CountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chm1 = CountedHiddenModel.objects.create(name="test-1270", category="a")
+            self.chm2 = CountedHiddenModel.objects.create(name="test-1271", category="a")
+            self.chm3 = CountedHiddenModel.objects.create(name="test-1272", category="b",
+                                                          deleted=True)
+    
+    def test_counts(self):
+        # counted once, then kept up to date without queries
+        with self.assertNumQueries(1):
+            self.assertEquals(Counts(2, 1), CountedHiddenModel.objects.counts())
+        with self.assertNumQueries(1):
+            self.assertEquals(Counts(2, 0), CountedHiddenModel.objects.counts("a"))
         
+        with self.captureOnCommitCallbacks(execute=True):
+            CountedHiddenModel.objects.create(name="test-1273", category="a")
+            self.chm1.hide()
+            self.chm2.category = "b"
+            self.chm2.save()
+            CountedHiddenModel.objects.bulk_create([CountedHiddenModel(name="test-1274", 
+                                                                       category="b")])
+        with self.assertNumQueries(0):
+            self.assertEquals(Counts(3, 2), CountedHiddenModel.objects.counts())
+        self.assertEquals(Counts(1, 1), CountedHiddenModel.objects.counts("a"))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            CountedHiddenModel.objects.filter(include_hidden=True).unhide(chunk_size=1)
+            self.chm2.delete()
+            CountedHiddenModel.objects.hide(name="test-1274")
+            CountedHiddenModel.objects.purge_hidden()
+        with self.assertNumQueries(0):
+            self.assertEquals(Counts(3, 0), CountedHiddenModel.objects.counts())
+        self.assertEquals(Counts(2, 0), CountedHiddenModel.objects.counts("a"))
+        
+        self.assertRaises(ImproperlyConfigured, HiddenModel.objects.counts)
+    
+    def test_drift(self):
+        CountedHiddenModel.objects.counts()
+        with self.captureOnCommitCallbacks(execute=True):
+            CountedHiddenModel.objects.update(name="test-1275")
+        with self.assertNumQueries(1):
+            self.assertEquals(Counts(2, 1), CountedHiddenModel.objects.counts())
+        
+        # writes the counters don't see are fixed by reconciling
+        CountedHiddenModel._base_manager.update(deleted=True)
+        self.assertEquals(Counts(2, 1), CountedHiddenModel.objects.counts())
+        out = StringIO()
+        call_command("reconcile_counts", stdout=out)
+        self.assertTrue("model_ninja_tests.CountedHiddenModel: 0 visible, 3 hidden "
+                        "(was 2 visible, 1 hidden)" in out.getvalue())
+        self.assertEquals(Counts(0, 3), CountedHiddenModel.objects.counts())
+        self.assertRaises(CommandError, call_command, "reconcile_counts", 
+                          "model_ninja_tests.HiddenModel")
+    
+    def test_paginator(self):
+        CountedHiddenModel.objects.counts()
+        CountedHiddenModel.objects.counts("a")
+        queryset = CountedHiddenModel.objects.order_by("pk")
+        with self.assertNumQueries(0):
+            self.assertEquals(2, CountedPaginator(queryset, 10).count)
+            self.assertEquals(3, CountedPaginator(queryset.include_hidden(), 10).count)
+            self.assertEquals(2, CountedPaginator(queryset.filter(category="a"), 10).count)
+        with self.assertNumQueries(1):
+            self.assertEquals(1, CountedPaginator(queryset.filter(name="test-1270"), 10).count)
+        with self.assertNumQueries(1):
+            self.assertEquals(1, CountedPaginator(queryset[:1], 10).count)
+
+
+class VisibleUniqueTests(TestCase):
+    def setUp(self):
+        self.vum1 = VisibleUniqueModel.objects.create(name="test-5830", disabled=True)
+        self.vum2 = VisibleUniqueModel.objects.create(name="test-5830")
+    
+    def test_constraint(self):
+        constraint = VisibleUniqueModel._meta.constraints[0]
+        self.assertEquals(["name"], list(constraint.fields))
+        self.assertEquals(models.Q(disabled=False), constraint.condition)
+        self.assertTrue(constraint.name.endswith("_vuq"))
+        self.assertTrue(constraint in ProjectState.from_apps(VisibleUniqueModel._meta.apps)
+                        .models["model_ninja_tests", "visibleuniquemodel"].options["constraints"])
+        
+        # hidden duplicates are allowed, visible ones are not
+        VisibleUniqueModel.objects.create(name="test-5830", disabled=True)
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, VisibleUniqueModel.objects.create,
+                              name="test-5830")
+        self.assertRaises(ValidationError, VisibleUniqueModel(name="test-5830").full_clean)
+        VisibleUniqueModel(name="test-5830", disabled=True).full_clean()
+    
+    def test_get_or_create(self):
+        with self.assertNumQueries(1):
+            self.assertEquals((self.vum2, False), 
+                              VisibleUniqueModel.objects.get_or_create(name="test-5830"))
+        
+        # hidden objects neither match nor raise HiddenObjectError
+        VisibleUniqueModel.objects.create(name="test-5831", disabled=True)
+        with self.assertNumQueries(4):
+            obj, created = VisibleUniqueModel.objects.get_or_create(name="test-5831")
+        self.assertTrue(created)
+        self.assertFalse(obj.disabled)
+        
+        results = list(VisibleUniqueModel.objects.bulk_get_or_create(
+                           [{"name": "test-5830"}, {"name": "test-5832"}]))
+        self.assertEquals([(self.vum2, BULK_EXISTING), (results[1][1], BULK_CREATED)],
+                          [(obj, status) for lookup, obj, status in results])
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        return "replica"
+    
+    def db_for_write(self, model, **hints):
+        return "default"
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.hm1 = HiddenModel.objects.create(name="test-9140")
+        self.hm2 = HiddenModel.objects.create(name="test-9141", deleted=True)
+        instrumentation.enable(lambda sender, call, **kwargs: self.calls.append(call),
+                               count_hidden=True)
+        self.addCleanup(instrumentation.disable)
+    
+    def test_calls(self):
+        HiddenModel.objects.get(name="test-9140")
+        self.assertRaises(HiddenModel.DoesNotExist, HiddenModel.objects.get, name="test-9141")
+        self.assertRaises(HiddenObjectError, HiddenModel.objects.get_or_create, 
+                          name="test-9141")
+        HiddenModel.objects.hide(name="test-9140")
+        
+        self.assertEquals([(HiddenModel, "get", 1, 0, False, None),
+                           (HiddenModel, "get", 1, 1, False, HiddenModel.DoesNotExist),
+                           (HiddenModel, "get_or_create", 1, 0, True, None),
+                           (HiddenModel, "hide", 1, 0, False, None)],
+                          [(call.model, call.method, call.queries, call.hidden_filtered,
+                            call.hidden_error, call.error) for call in self.calls])
+        self.assertTrue(all(call.duration > 0 for call in self.calls))
+    
+    def test_using(self):
+        # writes are counted on the database the router picks for writes
+        with self.settings(DATABASE_ROUTERS=[ReplicaRouter()]):
+            HiddenModel.objects.hide(name="test-9140")
+            HiddenModel.objects.unhide(name="test-9140")
+        self.assertEquals([("hide", "default", 1), ("unhide", "default", 1)],
+                          [(call.method, call.using, call.queries) for call in self.calls])
+    
+    def test_disable(self):
+        instrumentation.disable()
+        HiddenModel.objects.get(name="test-9140")
+        self.assertEquals([], self.calls)
+        self.assertFalse(instrumentation.is_enabled())
+    
+    def test_stats_sink(self):
+        stats = {}
+        sink = instrumentation.StatsSink(stats.__setitem__)
+        instrumentation.enable(sink, count_hidden=True)
+        self.assertRaises(HiddenModel.DoesNotExist, HiddenModel.objects.get, name="test-9141")
+        prefix = "model_ninja.model_ninja_tests.hiddenmodel.get."
+        self.assertEquals(set([prefix + "calls", prefix + "time", prefix + "queries",
+                               prefix + "hidden_filtered"]), set(stats))
+        self.assertEquals(1, stats[prefix + "hidden_filtered"])
+
+
+class OptionsTests(TestCase):
+    def test_options(self):
+        options = HiddenModel._meta.hideable
+        self.assertEquals("deleted", options.hidden_field_name)
+        self.assertEquals(frozenset(["deleted", "deleted__exact"]), options.hidden_lookups)
+        self.assertEquals((("name",),), options.visible_indexes)
+        self.assertTrue(options.visible_pk_index and options.local)
+        self.assertFalse(options.include_hidden)
+        self.assertEquals("disabled", CustomHiddenModel._meta.hideable.hidden_field_name)
+        self.assertEquals(None, ArchivedHiddenModel.archive_model._meta.hideable)
+        
+        hm = HiddenModel.objects.create(name="test-7310", deleted=True)
+        self.assertEquals([hm], list(HiddenModel.objects.filter(deleted__exact=True)))
+    
+    @isolate_apps("model_ninja.tests")
+    def test_settings(self):
+        with self.settings(MODEL_NINJA_INCLUDE_HIDDEN=True, MODEL_NINJA_VISIBLE_PK_INDEX=False):
+            class SettingsHiddenModel(AbstractHideableModel):
+                name = models.CharField(max_length=10)
+                
+                class Meta:
+                    app_label = "model_ninja_tests"
+        
+        options = SettingsHiddenModel._meta.hideable
+        self.assertTrue(options.include_hidden)
+        self.assertEquals([], SettingsHiddenModel._meta.indexes)
+        self.assertTrue(SettingsHiddenModel.objects.all().includes_hidden)
+        self.assertFalse(SettingsHiddenModel.objects.all(include_hidden=False).includes_hidden)
+        self.assertFalse(SettingsHiddenModel.objects.filter(include_hidden=False).includes_hidden)
+        self.assertEquals({"name": "test"},
+                          SettingsHiddenModel.objects._kwargs_for_query({"name": "test"}))
+        
+        # model attributes take precedence over the settings
+        with self.settings(MODEL_NINJA_INCLUDE_HIDDEN=True):
+            class SettingsHiddenModel2(AbstractHideableModel):
+                include_hidden_by_default = False
+                
+                class Meta:
+                    app_label = "model_ninja_tests"
+        self.assertFalse(SettingsHiddenModel2.objects.all().includes_hidden)
+        self.assertEquals(1, len(SettingsHiddenModel2._meta.indexes))
+
+
+class StreamTests(TestCase):
+    def setUp(self):
+        self.objs = [HiddenModel.objects.create(name="test-47%02d" % i, deleted=i % 3 == 1)
+                     for i in range(7)]
+        self.visible = [obj for obj in self.objs if not obj.deleted]
+    
+    def test_stream(self):
+        with self.assertNumQueries(3):
+            self.assertEquals(self.visible, list(HiddenModel.objects.stream(chunk_size=2)))
+        with self.assertNumQueries(3):
+            self.assertEquals(self.objs, list(HiddenModel.objects.stream(include_hidden=True,
+                                                                         chunk_size=3)))
+        self.assertEquals(self.visible[1:], 
+                          list(HiddenModel.objects.filter(name__gt="test-4700").stream()))
+        self.assertEquals([], list(HiddenModel.objects.none().stream()))
+        self.assertRaises(TypeError, list, HiddenModel.objects.all()[:2].stream())
+    
+    def test_stream__only_fields(self):
+        rows = list(HiddenModel.objects.stream(include_hidden=True, only_fields=["name"]))
+        self.assertEquals([(obj.pk, obj.name, obj.deleted) for obj in self.objs], rows)
+    
+    def test_stream__resume(self):
+        stream = HiddenModel.objects.stream(include_hidden=True, chunk_size=2)
+        first = [next(stream), next(stream), next(stream)]
+        rest = list(HiddenModel.objects.stream(include_hidden=True, chunk_size=2,
+                                               start_after=first[-1].pk))
+        self.assertEquals(self.objs, first + rest)
+    
+    def test_stream__archive(self):
+        objs = [ArchivedHiddenModel.objects.create(name="test-471%d" % i) for i in range(3)]
+        objs[1].hide()
+        self.assertEquals([objs[0], objs[2]], list(ArchivedHiddenModel.objects.stream()))
+        self.assertEquals([obj.pk for obj in objs],
+                          [row[0] for row in ArchivedHiddenModel.objects.stream(
+                                include_hidden=True, chunk_size=1, only_fields=[])])
+    
+    async def test_astream(self):
+        self.assertEquals(self.visible, [obj async for obj in
+                                         HiddenModel.objects.astream(chunk_size=2)])
+        self.assertEquals(self.objs[3:], [obj async for obj in HiddenModel.objects.astream(
+                                              include_hidden=True, start_after=self.objs[2].pk)])
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.objs = [OutboxHiddenModel.objects.create(name="test-38%02d" % i) for i in range(5)]
+        self.pks = [obj.pk for obj in self.objs]
+        self.feed = ChangeFeed(OutboxHiddenModel)
+    
+    def test_records(self):
+        self.assertEquals(OutboxHiddenModel._meta.db_table + "_changes",
+                          OutboxHiddenModel.outbox_model._meta.db_table)
+        self.assertEquals(5, OutboxHiddenModel.objects.hide(name__startswith="test"))
+        OutboxHiddenModel.objects.unhide(pk__in=self.pks[:3], chunk_size=2)
+        self.objs[0].hide()
+        # nothing changed, nothing recorded
+        OutboxHiddenModel.objects.filter(include_hidden=True, pk=self.pks[0]).hide()
+        
+        changes = self.feed.fetch()
+        self.assertEquals([(self.pks, True), (self.pks[:2], False), (self.pks[2:3], False),
+                           ([self.pks[0]], True)],
+                          [(change.pks, change.hidden) for change in changes])
+        
+        # rolled back with the hide
+        with transaction.atomic():
+            OutboxHiddenModel.objects.hide(pk=self.pks[1])
+            transaction.set_rollback(True)
+        self.assertEquals(4, len(self.feed.fetch()))
+    
+    def test_outbox_model(self):
+        # registered with the app registry of the model, not the global one
+        test_apps = Apps()
+        
+        class IsolatedOutboxModel(AbstractHideableModel):
+            outbox = True
+            
+            class Meta:
+                app_label = "model_ninja_tests"
+                apps = test_apps
+        
+        outbox_model = IsolatedOutboxModel.outbox_model
+        self.assertTrue(outbox_model._meta.apps is test_apps)
+        self.assertEquals(outbox_model,
+                          test_apps.all_models["model_ninja_tests"]["isolatedoutboxmodelchange"])
+        self.assertFalse("isolatedoutboxmodelchange" in apps.all_models["model_ninja_tests"])
+    
+    def test_ack(self):
+        OutboxHiddenModel.objects.hide(pk=self.pks[0])
+        OutboxHiddenModel.objects.hide(pk=self.pks[1])
+        changes = self.feed.fetch(limit=1)
+        self.assertEquals([[self.pks[0]]], [change.pks for change in changes])
+        self.assertEquals(1, self.feed.ack(changes))
+        self.assertEquals([[self.pks[1]]], [change.pks for change in self.feed.fetch()])
+        self.assertEquals(0, self.feed.ack([]))
+    
+    def test_consume(self):
+        for pk in self.pks:
+            OutboxHiddenModel.objects.hide(pk=pk)
+        batches = []
+        self.assertEquals(4, self.feed.consume(batches.append, limit=2, max_batches=2))
+        self.assertEquals([[[pk] for pk in self.pks[:2]], [[pk] for pk in self.pks[2:4]]],
+                          [[change.pks for change in batch] for batch in batches])
+        
+        def fail(changes):
+            raise ValueError
+        self.assertRaises(ValueError, self.feed.consume, fail)
+        self.assertEquals(1, self.feed.consume(batches.append))
+        self.assertEquals([], self.feed.fetch())
+        self.assertRaises(ImproperlyConfigured, ChangeFeed, HiddenModel)
+
+
+class VisibleViewTests(TransactionTestCase):
+    def setUp(self):
+        self.state = ProjectState.from_apps(ViewHiddenModel._meta.apps)
+        with connection.schema_editor() as editor:
+            CreateVisibleView("viewhiddenmodel").database_forwards(
+                "model_ninja_tests", editor, self.state, self.state)
+        self.vhm1 = ViewHiddenModel.objects.create(name="test-6120")
+        self.vhm2 = ViewHiddenModel.objects.create(name="test-6121", deleted=True)
+    
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            RemoveVisibleView("viewhiddenmodel").database_forwards(
+                "model_ninja_tests", editor, self.state, self.state)
+    
+    def _views(self):
+        with connection.cursor() as cursor:
+            return [table.name for table in connection.introspection.get_table_list(cursor)
+                    if table.type == "v"]
+    
+    def test_queries(self):
+        table = ViewHiddenModel._meta.db_table
+        self.assertEquals([table + "_visible"], self._views())
+        
+        queryset = ViewHiddenModel.objects.filter(name__startswith="test")
+        sql = str(queryset.query)
+        self.assertTrue(table + "_visible" in sql)
+        self.assertFalse("deleted" in sql.split("WHERE")[1])
+        self.assertFalse(table + "_visible" in str(queryset.include_hidden().query))
+        
+        self.assertEquals([self.vhm1], list(queryset))
+        self.assertEquals(1, ViewHiddenModel.objects.count())
+        self.assertEquals(2, ViewHiddenModel.objects.filter(include_hidden=True).count())
+        self.assertEquals(self.vhm1, ViewHiddenModel.objects.get(name="test-6120"))
+        self.assertRaises(HiddenObjectError, ViewHiddenModel.objects.get_or_create,
+                          name="test-6121")
+        self.assertEquals(set([self.vhm1.pk]), set(ViewHiddenModel.objects.values_list(
+                                                       "pk", flat=True)))
+        
+        # writes go to the table
+        self.assertEquals(1, ViewHiddenModel.objects.update(name="test-6122"))
+        ViewHiddenModel.objects.hide(name="test-6122")
+        self.assertEquals(0, ViewHiddenModel.objects.count())
+        ViewHiddenModel.objects.unhide(name="test-6121")
+        self.assertEquals(["test-6121"], list(ViewHiddenModel.objects.values_list(
+                                                  "name", flat=True)))
+        
+        # other readers of the database see the same rows
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM %s" % connection.ops.quote_name(table + "_visible"))
+            self.assertEquals([("test-6121",)], cursor.fetchall())
+    
+    def test_operations(self):
+        operation = CreateVisibleView("viewhiddenmodel")
+        self.assertEquals(("CreateVisibleView", [], {"model_name": "viewhiddenmodel"}),
+                          operation.deconstruct())
+        with connection.schema_editor() as editor:
+            operation.database_backwards("model_ninja_tests", editor, self.state, self.state)
+        self.assertEquals([], self._views())
+        with connection.schema_editor() as editor:
+            operation.database_forwards("model_ninja_tests", editor, self.state, self.state)
+            # replaces the existing view
+            operation.database_forwards("model_ninja_tests", editor, self.state, self.state)
+        self.assertEquals([ViewHiddenModel._meta.db_table + "_visible"], self._views())
+    
+    def test_operations__redefine(self):
+        # unapplying a redefinition (e.g. after adding a field) restores the
+        # previous view, unapplying the first definition drops it
+        create = CreateVisibleView("viewhiddenmodel")
+        created_state = self.state.clone()
+        create.state_forwards("model_ninja_tests", created_state)
+        redefine = CreateVisibleView("viewhiddenmodel")
+        redefined_state = created_state.clone()
+        redefine.state_forwards("model_ninja_tests", redefined_state)
+        views = [ViewHiddenModel._meta.db_table + "_visible"]
+        
+        with connection.schema_editor() as editor:
+            redefine.database_forwards("model_ninja_tests", editor, created_state,
+                                       redefined_state)
+            redefine.database_backwards("model_ninja_tests", editor, redefined_state,
+                                        created_state)
+        self.assertEquals(views, self._views())
+        self.assertEquals([self.vhm1], list(ViewHiddenModel.objects.all()))
+        with connection.schema_editor() as editor:
+            create.database_backwards("model_ninja_tests", editor, created_state, self.state)
+        self.assertEquals([], self._views())
+        
+        # a removal drops, and unapplying it recreates, the view as the last
+        # CreateVisibleView defined it
+        create = CreateVisibleView("viewhiddenmodel", view_name="test_visible")
+        create.state_forwards("model_ninja_tests", created_state)
+        remove = RemoveVisibleView("viewhiddenmodel")
+        removed_state = created_state.clone()
+        remove.state_forwards("model_ninja_tests", removed_state)
+        with connection.schema_editor() as editor:
+            remove.database_backwards("model_ninja_tests", editor, removed_state,
+                                      created_state)
+        self.assertEquals(["test_visible"], self._views())
+        with connection.schema_editor() as editor:
+            remove.database_forwards("model_ninja_tests", editor, created_state,
+                                     removed_state)
+        self.assertEquals([], self._views())
+    
+    @isolate_apps("model_ninja.tests")
+    def test_multi_table_child(self):
+        with self.assertRaises(ImproperlyConfigured):
+            class ViewChildModel(ViewHiddenModel):
+                visible_view = True
+                
+                class Meta:
+                    app_label = "model_ninja_tests"
+        
+        class ViewChildModel2(ViewHiddenModel):
+            class Meta:
+                app_label = "model_ninja_tests"
+        self.assertEquals(None, ViewChildModel2._meta.hideable.visible_view)
+
+
+class VisibleIndexTests(TransactionTestCase):
+    def _index_columns(self, model):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                            cursor, model._meta.db_table)
+        return dict((name, c['columns']) for name, c in constraints.items()
+                    if c['index'] and not c['primary_key'])
+    
+    def test_indexes(self):
+        # default, automatic pk index plus the declared 'visible_indexes'
+        indexes = dict((tuple(index.fields), index) for index in HiddenModel._meta.indexes)
+        self.assertEquals(set([("id",), ("name",)]), set(indexes))
+        for index in indexes.values():
+            self.assertEquals(models.Q(deleted=False), index.condition)
+            self.assertTrue(index.name.endswith("_vis"))
+            self.assertTrue(len(index.name) <= 30)
+        
+        # custom, automatic pk index only, conditioned on the custom field
+        self.assertEquals([["id"]], [index.fields for index in CustomHiddenModel._meta.indexes])
+        self.assertEquals(models.Q(disabled=False), CustomHiddenModel._meta.indexes[0].condition)
+        
+        # indexes exist in the database
+        columns = self._index_columns(HiddenModel)
+        for index in HiddenModel._meta.indexes:
+            self.assertEquals(index.fields, columns[index.name])
+    
+    def test_operations(self):
+        index = [index for index in HiddenModel._meta.indexes if index.fields == ["name"]][0]
+        state = ProjectState.from_apps(HiddenModel._meta.apps)
+        
+        remove = RemoveVisibleIndex("hiddenmodel", index.name)
+        removed_state = state.clone()
+        remove.state_forwards("model_ninja_tests", removed_state)
+        with connection.schema_editor() as editor:
+            remove.database_forwards("model_ninja_tests", editor, state, removed_state)
+        self.assertFalse(index.name in self._index_columns(HiddenModel))
+        
+        add = AddVisibleIndex("hiddenmodel", index)
+        added_state = removed_state.clone()
+        add.state_forwards("model_ninja_tests", added_state)
+        with connection.schema_editor() as editor:
+            add.database_forwards("model_ninja_tests", editor, removed_state, added_state)
+        self.assertEquals(["name"], self._index_columns(HiddenModel)[index.name])
+
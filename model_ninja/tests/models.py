@@ -0,0 +1,100 @@
+from django.db import models
+
+from model_ninja.db.models import (AbstractHideableModel, AbstractTimestampedHideableModel,
+                                   HideableModelManager, ARCHIVE_ON_HIDE, HIDE_CASCADE,
+                                   HIDE_IGNORE, HIDE_PROTECT)
+
+
+class HiddenModel(models.Model):
+    name = models.CharField(max_length=10)
+    deleted = models.BooleanField(default=False)
+    objects = HideableModelManager() 
+    
+    visible_indexes = ('name',)
+    hide_relations = {"children": HIDE_CASCADE}
+
+
+class CustomHiddenManager(HideableModelManager):
+    hidden_field_name = "disabled"
+
+
+class CustomHiddenModel(models.Model):
+    name = models.CharField(max_length=10)
+    disabled = models.BooleanField(default=False)
+    objects = CustomHiddenManager()
+    
+    hide_relations = {"related": HIDE_PROTECT}
+
+
+class UniqueHiddenModel(models.Model):
+    name = models.CharField(max_length=10, unique=True)
+    deleted = models.BooleanField(default=False)
+    objects = HideableModelManager()
+
+
+class RankedHiddenModel(models.Model):
+    name = models.CharField(max_length=10, unique=True)
+    rank = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    objects = HideableModelManager()
+
+
+class RelatedHiddenModel(models.Model):
+    name = models.CharField(max_length=10)
+    parent = models.ForeignKey(HiddenModel, related_name="children", 
+                               on_delete=models.CASCADE)
+    tags = models.ManyToManyField(CustomHiddenModel, related_name="related")
+    deleted = models.BooleanField(default=False)
+    objects = HideableModelManager()
+    
+    hide_relations = {"hideable_children": HIDE_CASCADE, "tags": HIDE_IGNORE}
+
+
+class HideableChildModel(AbstractHideableModel):
+    name = models.CharField(max_length=10)
+    parent = models.ForeignKey(RelatedHiddenModel, related_name="hideable_children",
+                               null=True, on_delete=models.CASCADE)
+
+
+class ArchivedHiddenModel(AbstractHideableModel):
+    name = models.CharField(max_length=10)
+    
+    archive_mode = ARCHIVE_ON_HIDE
+
+
+class TimestampedHiddenModel(AbstractTimestampedHideableModel):
+    name = models.CharField(max_length=10)
+
+
+class CountedHiddenModel(AbstractHideableModel):
+    name = models.CharField(max_length=10)
+    category = models.CharField(max_length=10)
+    
+    maintain_counts = True
+    count_by = "category"
+
+
+class CachedHiddenModel(AbstractHideableModel):
+    name = models.CharField(max_length=10)
+    
+    cache_objects = True
+
+
+class VisibleUniqueModel(models.Model):
+    name = models.CharField(max_length=10)
+    disabled = models.BooleanField(default=False)
+    objects = CustomHiddenManager()
+    
+    visible_unique = ("name",)
+
+
+class ViewHiddenModel(AbstractHideableModel):
+    name = models.CharField(max_length=10)
+    
+    visible_view = True
+
+
+class OutboxHiddenModel(AbstractHideableModel):
+    name = models.CharField(max_length=10)
+    
+    outbox = True
@@ -14,13 +14,13 @@ base_config = {'name': 'model_ninja',
                'license': 'Affero GPL v3',
                'include_package_data': True,
                'zip_safe': False,
-               'install_requires': ['Django>=1.5'],
+               'install_requires': ['Django>=4.1'],
                'classifiers': ['Development Status :: 2 - Pre-Alpha',
                                'Environment :: Web Environment',
                                'Framework :: Django',
                                'Intended Audience :: Developers',
                                'License :: OSI Approved :: GNU Affero General Public License v3 or later (AGPLv3+)',
-                               'Programming Language :: Python :: 2 :: Only']
+                               'Programming Language :: Python :: 3']
               }
                         
 if 'develop' in sys.argv: